@@ -3,3 +3,4 @@
 from . import models
 from . import services
 from . import controllers
+from .hooks import post_load
@@ -6,13 +6,14 @@
 {
     "name": "Payment Gateway",
     "summary": "Payment Gateway alternative for odoo",
-    "version": "10.0.1.0.0",
+    "version": "10.0.1.2.0",
     "category": "Payment",
     "website": "www.akretion.com",
     "author": " Akretion",
     "license": "AGPL-3",
     "application": False,
     'installable': True,
+    "post_load": "post_load",
     "external_dependencies": {
         "python": [],
         "bin": [],
@@ -25,6 +26,7 @@
         "base_suspend_security",
     ],
     "data": [
+        "data/ir_cron.xml",
         "views/account_payment_mode_view.xml",
         "views/gateway_transaction_view.xml",
         "security/ir.model.access.csv",
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+"""
+Benchmark of the hot paths of the gateway (generate, generate_multi,
+capture, webhook dispatch and move completion) against mocked providers.
+
+The requests of stripe and adyen are answered with the responses recorded
+in the cassettes of their tests, paypal is mocked with paypal_mock.
+The benchmark is run on a database where the modules to benchmark are
+installed, all the changes are rolled back at the end.
+
+Usage: python bench_gateway.py -c odoo.cfg -d database
+    [--size 1000] [--size 10000] [--provider stripe] [--operation capture]
+    [--output result.json] [--compare baseline.json] [--threshold 10]
+
+With --compare the result is compared with a previous run and the script
+exits with an error when an operation is slower than the threshold (in %).
+"""
+from __future__ import print_function
+
+import argparse
+import gc
+import glob
+import json
+import os
+import platform
+import re
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+import requests
+import yaml
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+import odoo
+from odoo import SUPERUSER_ID, api
+from odoo.modules.module import get_module_path
+
+try:
+    import tracemalloc
+except ImportError:
+    # python 2, the allocations are only measured with the retained
+    # objects and the resident memory
+    tracemalloc = None
+
+SIZES = [1000, 10000, 100000]
+OPERATIONS = ['generate', 'generate_multi', 'capture', 'webhook',
+              'completion']
+
+CASSETTES = {
+    'stripe': 'test_create_transaction_3d_not_supported.yaml',
+    'adyen': 'test_create_transaction_france.yaml',
+    }
+
+ACCOUNTS = {
+    'stripe': {'clear_password': 'offline', 'data': '{}'},
+    'adyen': {'clear_password': 'offline', 'data': json.dumps({
+        'merchant_account': 'offline',
+        'username': 'offline',
+        'platform': 'test',
+        'app_name': 'benchmark',
+        })},
+    'paypal': {'clear_password': 'offline', 'data': json.dumps({
+        'client_id': 'offline',
+        'experience_profile_id': 'offline',
+        })},
+    }
+
+GENERATE_PARAMS = {
+    'stripe': {
+        'token': 'src_1CMAAJE60z0O0voXA8eN62hP',
+        'return_url': 'https://example.com/return',
+        },
+    'adyen': {
+        'token': 'adyenjs_0_1_18$benchmark',
+        'accept_header': 'text/html',
+        'user_agent': 'Mozilla/5.0',
+        'shopper_ip': '42.42.42.42',
+        },
+    'paypal': {
+        'return_url': 'https://example.com/return',
+        'redirect_cancel_url': 'https://example.com/cancel',
+        'redirect_success_url': 'https://example.com/success',
+        },
+    }
+
+EXTERNAL_ID = {
+    'stripe': 'src_bench%s',
+    'adyen': '85352966501%s',
+    'paypal': 'PAY-BENCH%s',
+    }
+
+
+def _url_key(method, url):
+    """Key of a request, the ids and the api version of the url and the
+    query are ignored"""
+    parts = []
+    for part in url.split('?')[0].split('/'):
+        if re.match(r'^v[0-9]+$', part):
+            part = 'v*'
+        elif len(part) > 8 and re.search('[0-9]', part):
+            part = '*'
+        parts.append(part)
+    return method.upper(), '/'.join(parts)
+
+
+class CassetteAdapter(BaseAdapter):
+    """Answer the requests with the responses recorded in vcr cassettes,
+    the first response recorded for the same method and url is used"""
+
+    def __init__(self, paths):
+        super(CassetteAdapter, self).__init__()
+        self.responses = {}
+        for path in paths:
+            with open(path) as f:
+                cassette = yaml.load(f, Loader=yaml.Loader)
+            for interaction in cassette['interactions']:
+                request = interaction['request']
+                key = _url_key(request['method'], request['uri'])
+                self.responses.setdefault(key, interaction['response'])
+
+    def send(self, request, **kwargs):
+        recorded = self.responses[_url_key(request.method, request.url)]
+        response = requests.Response()
+        response.status_code = recorded['status']['code']
+        response.reason = recorded['status']['message']
+        response.headers = CaseInsensitiveDict({
+            key: value[0] for key, value in recorded['headers'].items()
+            if key.lower() != 'content-encoding'})
+        body = recorded['body']['string']
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        response._content = body
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+# methods opening their own cursor to commit immediately
+DEDICATED_CURSORS = [
+    ('gateway.circuit.breaker', '_breaker_cursor'),
+    ('paypal.access.token', '_token_cursor'),
+    ]
+
+
+@contextmanager
+def benchmark_cursor(env):
+    """Write the circuit breakers and the paypal tokens with the cursor
+    of the benchmark, so they are rolled back too"""
+    @contextmanager
+    def cursor(record):
+        yield record.env.cr
+
+    patched = []
+    for model, method in DEDICATED_CURSORS:
+        if model in env:
+            model_class = type(env[model])
+            patched.append(
+                (model_class, method, model_class.__dict__.get(method)))
+            setattr(model_class, method, cursor)
+    try:
+        yield
+    finally:
+        for model_class, method, original in patched:
+            if original is None:
+                delattr(model_class, method)
+            else:
+                setattr(model_class, method, original)
+
+
+@contextmanager
+def measure(result):
+    gc.collect()
+    objects = len(gc.get_objects())
+    if tracemalloc:
+        tracemalloc.start()
+    start = time.time()
+    yield
+    result['seconds'] = time.time() - start
+    result['tps'] = result['size'] / result['seconds']
+    if tracemalloc:
+        result['allocated_peak_kb'] = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+    gc.collect()
+    result['retained_objects'] = len(gc.get_objects()) - objects
+    result['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Benchmark(object):
+
+    def __init__(self, env):
+        self.env = env
+        self.transaction_obj = env['gateway.transaction']
+
+    def _is_installed(self, module):
+        return bool(self.env['ir.module.module'].search([
+            ('name', '=', module), ('state', '=', 'installed')]))
+
+    def providers(self):
+        return [name for name in ('stripe', 'adyen', 'paypal')
+                if self._is_installed('payment_gateway_%s' % name)]
+
+    @contextmanager
+    def mock_provider(self, provider):
+        if provider == 'paypal':
+            from odoo.addons.payment_gateway_paypal.tests.paypal_mock import (
+                paypal_mock, PaypalPaymentSuccess)
+            import paypalrestsdk
+            with paypal_mock(PaypalPaymentSuccess):
+                # the mock only find the last payment created
+                paypalrestsdk.Payment(
+                    {'transactions': [{'amount': {'total': '42.00'}}]}
+                    ).create()
+                yield
+            return
+        path = os.path.join(
+            get_module_path('payment_gateway_%s' % provider),
+            'tests', 'fixtures', 'cassettes')
+        adapter = CassetteAdapter(
+            [os.path.join(path, CASSETTES[provider])] +
+            sorted(glob.glob(os.path.join(path, '*.yaml'))))
+        with self.transaction_obj._get_provider(provider) as service:
+            session = service._get_http_session()
+        adapters = dict(session.adapters)
+        session.mount('https://', adapter)
+        try:
+            yield
+        finally:
+            session.adapters.clear()
+            session.adapters.update(adapters)
+
+    def setup(self, provider):
+        self.env['keychain.account'].create(dict(
+            ACCOUNTS[provider],
+            namespace=provider,
+            name='Benchmark %s' % provider,
+            technical_name='benchmark_%s' % provider))
+        mode = self.env['account.payment.mode'].search(
+            [('provider', '=', provider)], limit=1)
+        product = self.env['product.product'].create({
+            'name': 'Benchmark', 'list_price': 42})
+        partner = self.env['res.partner'].create({
+            'name': 'Benchmark', 'email': 'bench@example.com'})
+        return self.env['sale.order'].create({
+            'partner_id': partner.id,
+            'payment_mode_id': mode.id,
+            'order_line': [(0, 0, {
+                'product_id': product.id,
+                'product_uom_qty': 1,
+                'price_unit': 42,
+                })],
+            })
+
+    def _create_transactions(self, provider, sale, size, state):
+        vals = self.transaction_obj._prepare_transaction(sale)
+        transactions = self.transaction_obj.browse()
+        for i in range(size):
+            transactions |= self.transaction_obj.with_context(
+                defer_current_transaction=True).create(dict(
+                    vals, state=state, amount=42,
+                    external_id=EXTERNAL_ID[provider] % i))
+        return transactions
+
+    def bench_generate(self, provider, sale, size, result):
+        params = GENERATE_PARAMS[provider]
+        with measure(result):
+            for i in range(size):
+                self.transaction_obj.generate(provider, sale, **params)
+
+    def bench_generate_multi(self, provider, sale, size, result):
+        params = GENERATE_PARAMS[provider]
+        origins = sale.browse([sale.id] * size)
+        with measure(result):
+            self.transaction_obj.generate_multi(provider, origins, **params)
+
+    def bench_capture(self, provider, sale, size, result):
+        transactions = self._create_transactions(
+            provider, sale, size, 'to_capture')
+        with measure(result):
+            transactions.capture_chunk()
+
+    def bench_webhook(self, provider, sale, size, result):
+        with self.transaction_obj._get_provider(provider) as service:
+            methods = service._webhook_method
+        if 'process_event' not in methods:
+            return False
+        transactions = self._create_transactions(
+            provider, sale, size, 'pending')
+        with measure(result):
+            for transaction in transactions:
+                self.transaction_obj.process_webhook(
+                    provider, 'process_event', {
+                        'id': 'evt_%s' % transaction.id,
+                        'data': {'object': {'id': transaction.external_id}},
+                        })
+
+    def bench_completion(self, provider, sale, size, result):
+        if not self._is_installed('payment_gateway_move_completion'):
+            return False
+        transactions = self._create_transactions(
+            provider, sale, size, 'succeeded')
+        rule = self.env['account.move.completion.rule']
+        lines = [type('Line', (object,), {'transaction_ref': ref})()
+                 for ref in transactions.mapped('external_id')]
+        with measure(result):
+            for line in lines:
+                rule.get_from_transaction_id_and_gateway_transaction(line)
+
+    def run(self, providers, operations, sizes):
+        results = []
+        cr = self.env.cr
+        for provider in providers:
+            for operation in operations:
+                for size in sizes:
+                    result = {
+                        'provider': provider,
+                        'operation': operation,
+                        'size': size,
+                        }
+                    cr.execute('SAVEPOINT benchmark')
+                    try:
+                        sale = self.setup(provider)
+                        with self.mock_provider(provider):
+                            done = getattr(self, 'bench_%s' % operation)(
+                                provider, sale, size, result)
+                    finally:
+                        cr.execute('ROLLBACK TO SAVEPOINT benchmark')
+                        self.env.invalidate_all()
+                    if done is False:
+                        break
+                    print('%-8s %-15s %7d %10.1f tx/s %8d objects' % (
+                        provider, operation, size, result['tps'],
+                        result['retained_objects']))
+                    results.append(result)
+        return results
+
+
+def compare(baseline, results, threshold):
+    """Print the difference of throughput with the baseline
+    :return: True if an operation is slower than the threshold"""
+    previous = {(r['provider'], r['operation'], r['size']): r
+                for r in baseline['results']}
+    regression = False
+    for result in results:
+        key = (result['provider'], result['operation'], result['size'])
+        if key not in previous:
+            continue
+        delta = (result['tps'] / previous[key]['tps'] - 1) * 100
+        slower = delta < -threshold
+        regression |= slower
+        print('%-8s %-15s %7d %10.1f -> %10.1f tx/s %+6.1f%%%s' % (
+            key + (previous[key]['tps'], result['tps'], delta,
+                   ' REGRESSION' if slower else '')))
+    return regression
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-c', '--config')
+    parser.add_argument('-d', '--database', required=True)
+    parser.add_argument('--size', type=int, action='append')
+    parser.add_argument('--provider', action='append')
+    parser.add_argument('--operation', action='append', choices=OPERATIONS)
+    parser.add_argument('--output')
+    parser.add_argument('--compare')
+    parser.add_argument('--threshold', type=float, default=10)
+    args = parser.parse_args()
+
+    odoo.tools.config.parse_config(
+        ['-c', args.config] if args.config else [])
+    registry = odoo.registry(args.database)
+    cr = registry.cursor()
+    try:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        benchmark = Benchmark(env)
+        with benchmark_cursor(env):
+            results = benchmark.run(
+                args.provider or benchmark.providers(),
+                args.operation or OPERATIONS,
+                args.size or SIZES[:1])
+    finally:
+        cr.rollback()
+        cr.close()
+
+    output = {
+        'python': platform.python_version(),
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'results': results,
+        }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+"""
+Benchmark of the requests sent by several threads with a new connection
+for each request and with the pooled http session of the providers,
+against a local http server standing in for a provider.
+
+Usage: python bench_http_pool.py [number of request] [number of thread]
+"""
+from __future__ import print_function
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from http_pool import HttpSessionPool  # noqa
+
+RESPONSE = json.dumps({
+    'id': 'src_1CiPtu2eZvKYlo2CXHNJoXXU',
+    'status': 'chargeable',
+    }).encode('utf-8')
+
+
+class ProviderStandIn(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self):
+        self.connections.add(self.client_address)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def bench(name, get_session, url, number, thread_number):
+    ProviderStandIn.connections.clear()
+
+    def run():
+        for i in range(number // thread_number):
+            response = get_session().get(url)
+            assert response.json()['status'] == 'chargeable'
+
+    threads = [threading.Thread(target=run) for i in range(thread_number)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.time() - start
+    print('%-22s %8.3f ms/request %6d connections' % (
+        name, duration / number * 1000, len(ProviderStandIn.connections)))
+
+
+def main(number, thread_number):
+    server = Server(('127.0.0.1', 0), ProviderStandIn)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:%s/v1/sources' % server.server_port
+    pool = HttpSessionPool()
+    bench('session by request', requests.Session, url, number, thread_number)
+    bench('pooled session', lambda: pool.get('stripe', pool_size=4),
+          url, number, thread_number)
+    print('pool stats: %s' % pool.stats())
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 4)
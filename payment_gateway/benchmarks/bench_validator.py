@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+"""
+Micro benchmark of the validation of the webhook parameters done by
+PaymentService._secure_params, with a validator built for each dispatch
+and with a cached validator.
+
+Usage: python bench_validator.py [number of dispatch]
+"""
+from __future__ import print_function
+
+import sys
+import timeit
+
+from cerberus import Validator
+
+# schema of the stripe process_event webhook
+SCHEMA = {
+    'data': {
+        'type': 'dict',
+        'schema': {
+            'object': {
+                'type': 'dict',
+                'schema': {
+                    'id': {'type': 'string'},
+                }
+            }
+        }
+    }
+}
+
+PARAMS = {
+    'id': 'evt_1CiPtv2eZvKYlo2CcUZsDcO6',
+    'type': 'source.chargeable',
+    'data': {'object': {'id': 'src_1CiPtu2eZvKYlo2CXHNJoXXU'}},
+}
+
+
+def build_validator():
+    validator = Validator(SCHEMA, purge_unknown=True)
+    validator.validate(PARAMS)
+    return validator.document
+
+
+CACHED_VALIDATOR = Validator(SCHEMA, purge_unknown=True)
+
+
+def cached_validator():
+    CACHED_VALIDATOR.validate(PARAMS)
+    return CACHED_VALIDATOR.document
+
+
+def main(number):
+    assert build_validator() == cached_validator()
+    for name, func in [
+            ('validator by dispatch', build_validator),
+            ('cached validator', cached_validator)]:
+        duration = min(timeit.repeat(func, number=number, repeat=3))
+        print('%-25s %8.1f us/dispatch' % (name, duration / number * 10**6))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -4,6 +4,8 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
 from odoo import http
+from odoo.tools import config, consteq
+from odoo.addons.payment_gateway.metrics import METRICS, render
 
 
 class PaymentGatewayWebhook(http.Controller):
@@ -17,8 +19,8 @@ class PaymentGatewayWebhook(http.Controller):
         methods=['POST'])
     def payment_gateway_http_hook(
             self, provider_name=None, method_name=None, **params):
-        http.request.env['gateway.transaction'].sudo().with_delay()\
-            .process_webhook(provider_name, method_name, params)
+        http.request.env['gateway.transaction'].sudo()._enqueue_webhook(
+            provider_name, method_name, params)
         return ''
 
     @http.route(
@@ -30,6 +32,32 @@ class PaymentGatewayWebhook(http.Controller):
         methods=['POST'])
     def payment_gateway_json_hook(self, provider_name=None, method_name=None):
         params = http.request.jsonrequest
-        http.request.env['gateway.transaction'].sudo().with_delay()\
-            .process_webhook(provider_name, method_name, params)
-        return True
+        httprequest = http.request.httprequest
+        transaction_obj = http.request.env['gateway.transaction'].sudo()
+        transaction_obj._enqueue_webhook(
+            provider_name, method_name, params,
+            payload=httprequest.get_data(), headers=httprequest.headers)
+        with transaction_obj._get_provider(provider_name) as provider:
+            result = provider._get_webhook_response(method_name)
+            if provider._webhook_raw_response:
+                # sent as the raw body of the answer by ir.http
+                http.request.gateway_webhook_response = result
+            return result
+
+    @http.route(
+        '/payment-gateway/metrics',
+        type='http',
+        auth='none',
+        methods=['GET'])
+    def payment_gateway_metrics(self, token=None, **params):
+        """Metrics of the gateway operations of all the workers in the
+        prometheus text format, protected by the token of the
+        payment_gateway_metrics_token option of the server. The access
+        is refused when the option is not set"""
+        expected = config.get('payment_gateway_metrics_token')
+        if not expected or not consteq(token or '', expected):
+            return http.Response('Forbidden', status=403)
+        METRICS.flush()
+        return http.Response(
+            render(METRICS.collect()),
+            content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo.exceptions import UserError
+
+
+class ProviderConnectionError(UserError):
+    """The provider can not be reached or do not respond, the provider
+    services raise it when they convert the errors of the provider
+    library so the outage is still counted by the circuit breaker"""
+
+
+class ProviderUnavailable(UserError):
+    """The circuit breaker of the provider account is open, the call
+    is refused without requesting the provider"""
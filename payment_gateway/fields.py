@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import json
+from psycopg2.extras import Json
+from odoo import fields
+
+# operators that can be used on jsonb field in a domain
+# ('meta', '@>', {'MD': 'xxx'}) the value is contained in the json,
+# ('meta', '=', {'MD': 'xxx'}) is converted to this containment
+# ('meta', '?', 'MD') the key exist in the json
+# a path can also be used on the left part of the leaf,
+# ('data.outcome.risk_level', '=', 'elevated')
+JSONB_OPERATORS = ('@>', '?')
+
+SQL_OPERATORS = {
+    '=': '=',
+    '!=': '<>',
+    '<': '<',
+    '>': '>',
+    '<=': '<=',
+    '>=': '>=',
+    'like': 'LIKE',
+    'ilike': 'ILIKE',
+    'not like': 'NOT LIKE',
+    'not ilike': 'NOT ILIKE',
+    'in': 'IN',
+    'not in': 'NOT IN',
+}
+
+# like on the columns, the records without the key match these operators
+NEGATIVE_OPERATORS = ('!=', 'not like', 'not ilike', 'not in')
+
+
+def json_load(value):
+    """Decode a json text, a text that is not a json is kept as a string
+    like the legacy text converted by the migrations"""
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+class Jsonb(fields.Serialized):
+    """ Json field stored in a jsonb column, it can be indexed with a GIN
+    index and searched with the JSONB_OPERATORS (see jsonb_condition) """
+    column_type = ('jsonb', 'jsonb')
+
+    def convert_to_column(self, value, record):
+        if value is None or value is False or value == {}:
+            # an empty value is stored as NULL, as it is read as {}
+            return None
+        if isinstance(value, basestring):
+            value = json_load(value)
+        return Json(value)
+
+    def convert_to_cache(self, value, record, validate=True):
+        if value is None or value is False:
+            return {}
+        if validate and isinstance(value, basestring):
+            # the values read from the database (validate=False) are
+            # already decoded by psycopg2, a string is a json string
+            return json_load(value)
+        return value
+
+
+def jsonb_condition(column, path, operator, value):
+    """
+    Build the sql condition of a domain leaf on a jsonb column
+    :param column: str, the sql column
+    :param path: list of the keys to follow in the json
+    :param operator: str, the operator of the leaf
+    :param value: the value of the leaf
+    :return: tuple (query, params)
+    """
+    if operator == '@>' or (operator == '=' and (
+            path or isinstance(value, (dict, list)))):
+        # the path is converted to a containment so the gin index is used
+        for key in reversed(path):
+            value = {key: value}
+        return '%s @> %%s' % column, [Json(value)]
+    if operator == '?':
+        if path:
+            return '%s #> %%s ? %%s' % column, [path, value]
+        return '%s ? %%s' % column, [value]
+    if not path or operator not in SQL_OPERATORS:
+        raise ValueError('Invalid operator %s for json field' % operator)
+    expression = '%s #>> %%s' % column
+    if operator in ('like', 'ilike', 'not like', 'not ilike'):
+        value = '%%%s%%' % value
+    elif operator in ('in', 'not in'):
+        value = tuple(unicode(val) for val in value)
+    elif isinstance(value, (int, long, float)):
+        expression = '(%s)::numeric' % expression
+    condition = '%s %s %%s' % (expression, SQL_OPERATORS[operator])
+    if operator in NEGATIVE_OPERATORS:
+        return (
+            '(%s OR %s IS NULL)' % (condition, expression),
+            [path, value, path])
+    return condition, [path, value]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import os
+
+from odoo.service.server import PreforkServer
+from odoo.tools import config
+
+from .metrics import METRICS
+
+
+def post_load():
+    """Share the metrics of the workers through the data dir, and archive
+    the metrics of the workers reaped by the prefork server. The archive is
+    only done when the module is loaded in the server wide modules"""
+    METRICS.directory = os.path.join(
+        config['data_dir'], 'payment_gateway_metrics')
+    worker_pop = PreforkServer.worker_pop
+    if getattr(worker_pop, 'gateway_metrics', False):
+        return
+
+    def gateway_worker_pop(self, pid):
+        if pid in self.workers:
+            METRICS.mark_process_dead(pid)
+        return worker_pop(self, pid)
+
+    gateway_worker_pop.gateway_metrics = True
+    PreforkServer.worker_pop = gateway_worker_pop
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+"""
+Pooled http sessions shared by the payment services of a worker, the
+connections to the providers are kept alive between the requests so the
+tcp and tls handshakes are only done once by connection of the pool.
+
+This module do not depend on odoo, the configuration is read by
+PaymentService._get_http_session
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 30
+DEFAULT_CONNECT_TIMEOUT = 5
+
+
+class PooledSession(requests.Session):
+    """Session with a default timeout, the timeout given to a call
+    is used instead when there is one"""
+
+    def __init__(self, pool_size, keep_alive, timeout):
+        super(PooledSession, self).__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        if not keep_alive:
+            self.headers['Connection'] = 'close'
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super(PooledSession, self).request(method, url, **kwargs)
+
+    def stats(self):
+        """Return the number of requests sent, and of connections
+        reused (hits) and opened (misses) to send them"""
+        requests_count = misses = 0
+        adapters = {id(a): a for a in self.adapters.values()}
+        for adapter in adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                requests_count += pool.num_requests
+                misses += pool.num_connections
+        return {
+            'requests': requests_count,
+            'hits': max(requests_count - misses, 0),
+            'misses': misses,
+            }
+
+
+class HttpSessionPool(object):
+    """Http sessions by provider, a session is rebuilt when its
+    configuration change"""
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider, pool_size=DEFAULT_POOL_SIZE, keep_alive=True,
+            timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_TIMEOUT)):
+        """Return the session of the provider
+        :param pool_size: number of connections kept by host
+        :param keep_alive: keep the connections open between the requests
+        :param timeout: default timeout of the requests in seconds, can be
+        a tuple (connect timeout, read timeout)
+        """
+        config = (pool_size, keep_alive, timeout)
+        with self._lock:
+            session, session_config = self._sessions.get(
+                provider, (None, None))
+            if session is None or session_config != config:
+                session = PooledSession(pool_size, keep_alive, timeout)
+                self._sessions[provider] = (session, config)
+        return session
+
+    def stats(self):
+        """:return: dict {provider: {'requests', 'hits', 'misses'}}"""
+        with self._lock:
+            sessions = dict(self._sessions)
+        return {provider: session.stats()
+                for provider, (session, config) in sessions.items()}
+
+    def clear(self):
+        with self._lock:
+            for session, config in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+# sessions shared by the threads of the worker
+HTTP_SESSIONS = HttpSessionPool()
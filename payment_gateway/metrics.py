@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+"""
+Latency and outcome metrics of the gateway operations.
+
+Each process records its operations in memory and dumps them regularly in
+a file of the metrics directory, the files of all the workers are merged
+when the metrics are exported in the prometheus text format. The files of
+the dead workers are merged in the archive of their host, so the counters
+never go down when a worker is recycled.
+
+This module do not depend on odoo
+"""
+
+import bisect
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from .http_pool import HTTP_SESSIONS
+_logger = logging.getLogger(__name__)
+
+# upper bounds in seconds of the buckets of the duration histogram
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf'))
+
+HISTOGRAM = 'payment_gateway_operation_duration_seconds'
+COUNTER = 'payment_gateway_operations_total'
+HTTP_COUNTER = 'payment_gateway_http_requests_total'
+
+# the directory can be shared by the servers of many hosts
+HOSTNAME = socket.gethostname()
+
+
+class Metrics(object):
+    """Duration histogram and counter of the operations by provider,
+    operation and result"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, flush_interval=10):
+        self.buckets = buckets
+        self.flush_interval = flush_interval
+        self.directory = None
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # {(provider, operation, result): [count, sum, [count by bucket]]}
+        self._series = {}
+        self._pid = os.getpid()
+        self._file_name = '%s-%s-%s.json' % (
+            HOSTNAME, self._pid, int(time.time()))
+        self._last_flush = time.time()
+
+    def observe(self, provider, operation, result, duration):
+        key = (provider, operation, result)
+        with self._lock:
+            if self._pid != os.getpid():
+                # forked worker, the metrics of the parent are not its own
+                self._reset()
+            serie = self._series.get(key)
+            if serie is None:
+                serie = self._series[key] = [0, 0., [0] * len(self.buckets)]
+            serie[0] += 1
+            serie[1] += duration
+            serie[2][bisect.bisect_left(self.buckets, duration)] += 1
+            flush = self.directory and \
+                time.time() - self._last_flush > self.flush_interval
+        if flush:
+            self.flush()
+
+    def snapshot(self):
+        """:return: the metrics of the process as a json serializable dict
+        """
+        counters = {}
+        for provider, stats in HTTP_SESSIONS.stats().items():
+            counters['%s:hit' % provider] = stats['hits']
+            counters['%s:miss' % provider] = stats['misses']
+        with self._lock:
+            series = [list(key) + [serie[0], serie[1], list(serie[2])]
+                      for key, serie in self._series.items()]
+        return {
+            'buckets': [str(bucket) for bucket in self.buckets],
+            'series': series,
+            'counters': counters,
+            }
+
+    def _write(self, name, data):
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.rename(tmp_path, os.path.join(self.directory, name))
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def flush(self):
+        """Dump the metrics of the process in the metrics directory"""
+        if not self.directory:
+            return
+        self._last_flush = time.time()
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            self._write(self._file_name, self.snapshot())
+        except (IOError, OSError):
+            _logger.warning('Fail to write the metrics', exc_info=True)
+
+    def _merge(self, names):
+        """Merge the metrics of the given files
+        :return: same format as snapshot"""
+        merged = {}
+        counters = {}
+        buckets = [str(bucket) for bucket in self.buckets]
+        for name in names:
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    data = json.load(f)
+            except (IOError, OSError, ValueError):
+                continue
+            if data['buckets'] != buckets:
+                continue
+            for serie in data['series']:
+                key = tuple(serie[:3])
+                count, total, by_bucket = serie[3:]
+                current = merged.setdefault(key, [0, 0., [0] * len(buckets)])
+                current[0] += count
+                current[1] += total
+                current[2] = [a + b for a, b in zip(current[2], by_bucket)]
+            for key, value in data['counters'].items():
+                counters[key] = counters.get(key, 0) + value
+        return {
+            'buckets': buckets,
+            'series': [list(key) + serie for key, serie in merged.items()],
+            'counters': counters,
+            }
+
+    def mark_process_dead(self, pid):
+        """Merge the files of a dead process of the host in the archive of
+        the host, must be called by the parent of the process once it is
+        reaped, as the archive of a host is only written by its parent"""
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        prefix = '%s-%s-' % (HOSTNAME, pid)
+        names = [name for name in os.listdir(self.directory)
+                 if name.startswith(prefix) and name.endswith('.json')]
+        if not names:
+            return
+        archive = 'archive-%s.json' % HOSTNAME
+        try:
+            self._write(archive, self._merge([archive] + names))
+            for name in names:
+                os.unlink(os.path.join(self.directory, name))
+        except (IOError, OSError):
+            _logger.warning('Fail to archive the metrics', exc_info=True)
+
+    def collect(self):
+        """Merge the metrics of all the processes, dead processes included
+        :return: same format as snapshot"""
+        if not self.directory or not os.path.isdir(self.directory):
+            return self.snapshot()
+        return self._merge([name for name in os.listdir(self.directory)
+                            if name.endswith('.json')])
+
+
+def _labels(**labels):
+    return ','.join('%s="%s"' % (key, str(labels[key]).replace('"', '\\"'))
+                    for key in sorted(labels))
+
+
+def render(data):
+    """Render the metrics in the prometheus text format"""
+    lines = [
+        '# HELP %s Duration of the payment gateway operations' % HISTOGRAM,
+        '# TYPE %s histogram' % HISTOGRAM,
+        ]
+    buckets = [bucket if bucket != 'inf' else '+Inf'
+               for bucket in data['buckets']]
+    for provider, operation, result, count, total, by_bucket in sorted(
+            data['series']):
+        labels = _labels(provider=provider, operation=operation,
+                         result=result)
+        cumulated = 0
+        for bucket, bucket_count in zip(buckets, by_bucket):
+            cumulated += bucket_count
+            lines.append('%s_bucket{%s,le="%s"} %s' % (
+                HISTOGRAM, labels, bucket, cumulated))
+        lines.append('%s_sum{%s} %s' % (HISTOGRAM, labels, repr(total)))
+        lines.append('%s_count{%s} %s' % (HISTOGRAM, labels, count))
+    lines += [
+        '# HELP %s Number of payment gateway operations' % COUNTER,
+        '# TYPE %s counter' % COUNTER,
+        ]
+    for provider, operation, result, count, total, by_bucket in sorted(
+            data['series']):
+        lines.append('%s{%s} %s' % (COUNTER, _labels(
+            provider=provider, operation=operation, result=result), count))
+    lines += [
+        '# HELP %s Number of http requests sent to the providers '
+        'on a reused (hit) or new (miss) connection' % HTTP_COUNTER,
+        '# TYPE %s counter' % HTTP_COUNTER,
+        ]
+    for key in sorted(data['counters']):
+        provider, connection = key.split(':')
+        lines.append('%s{%s} %s' % (HTTP_COUNTER, _labels(
+            provider=provider, connection=connection),
+            data['counters'][key]))
+    return '\n'.join(lines) + '\n'
+
+
+# metrics of the process
+METRICS = Metrics()
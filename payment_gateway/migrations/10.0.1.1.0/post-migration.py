@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    cr.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = 'gateway_transaction' AND column_name = 'data'
+        """)
+    if not cr.fetchone():
+        return
+    # move the payload to their own table
+    cr.execute("""
+        INSERT INTO gateway_transaction_payload (transaction_id, data, error)
+        SELECT id, data, error FROM gateway_transaction
+        WHERE data IS NOT NULL OR error IS NOT NULL
+        """)
+    cr.execute("""
+        ALTER TABLE gateway_transaction
+        DROP COLUMN data,
+        DROP COLUMN error
+        """)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    cr.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = 'gateway_transaction'
+            AND column_name = 'provider'
+        """)
+    if cr.fetchone():
+        return
+    # the column is filled in one query, otherwise the orm would compute
+    # the related field record by record
+    cr.execute("""
+        ALTER TABLE gateway_transaction ADD COLUMN provider varchar
+        """)
+    cr.execute("""
+        UPDATE gateway_transaction t SET provider = m.provider
+        FROM account_payment_mode m
+        WHERE m.id = t.payment_mode_id
+        """)
+    # the index of the lookups is built once on the filled column instead
+    # of in init(), CONCURRENTLY can not be used in the update transaction
+    cr.execute("""
+        CREATE INDEX gateway_transaction_provider_external_id_index
+        ON gateway_transaction (provider, external_id)
+        """)
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+# text that are not a valid json are kept as a json string
+TO_JSONB = """
+    CREATE OR REPLACE FUNCTION pg_temp.payment_gateway_to_jsonb(value text)
+    RETURNS jsonb AS $$
+    BEGIN
+        RETURN value::jsonb;
+    EXCEPTION WHEN others THEN
+        RETURN to_jsonb(value);
+    END;
+    $$ LANGUAGE plpgsql IMMUTABLE
+    """
+
+
+def convert_to_jsonb(cr, table, column):
+    cr.execute("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_name = %s AND column_name = %s
+        """, (table, column))
+    row = cr.fetchone()
+    if not row or row[0] == 'jsonb':
+        return
+    cr.execute(TO_JSONB)
+    cr.execute("""
+        ALTER TABLE %(table)s
+        ALTER COLUMN %(column)s TYPE jsonb
+        USING pg_temp.payment_gateway_to_jsonb(%(column)s)
+        """ % {'table': table, 'column': column})
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    convert_to_jsonb(cr, 'gateway_transaction', 'meta')
+    convert_to_jsonb(cr, 'gateway_transaction_payload', 'data')
+    # when migrating from 10.0.1.0.0 the data are still on the transaction,
+    # they are converted here so the post-migration of 10.0.1.1.0 can move
+    # them to the jsonb column of the payload
+    convert_to_jsonb(cr, 'gateway_transaction', 'data')
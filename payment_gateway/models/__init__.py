@@ -5,3 +5,9 @@ from . import account_invoice
 from . import account_payment_mode
 from . import sale
 from . import gateway_transaction
+from . import gateway_transaction_payload
+from . import gateway_webhook_event
+from . import gateway_circuit_breaker
+from . import keychain
+from . import component_builder
+from . import ir_http
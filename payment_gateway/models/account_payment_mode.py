@@ -5,6 +5,7 @@
 
 from odoo import api, fields, models
 from odoo.tools.translate import _
+from .gateway_circuit_breaker import BREAKER_STATES
 
 
 class AccountPaymentMode(models.Model):
@@ -16,6 +17,44 @@ class AccountPaymentMode(models.Model):
         domain=[('namespace', '!=', False)]
     )
     capture_payment = fields.Selection(selection='_selection_capture_payment')
+    breaker_state = fields.Selection(
+        BREAKER_STATES,
+        string='Circuit Breaker',
+        compute='_compute_breaker')
+    breaker_failure_count = fields.Integer(
+        string='Provider Failures',
+        compute='_compute_breaker')
+    breaker_opened_at = fields.Datetime(
+        string='Circuit Breaker Opened At',
+        compute='_compute_breaker')
+
+    @api.multi
+    def _get_breakers(self):
+        self.ensure_one()
+        domain = [('provider', '=', self.provider)]
+        if self.provider_account:
+            domain.append(('account_id', '=', self.provider_account.id))
+        return self.env['gateway.circuit.breaker'].sudo().search(domain)
+
+    @api.multi
+    def _compute_breaker(self):
+        severity = {'closed': 0, 'half_open': 1, 'open': 2}
+        for record in self:
+            if not record.provider:
+                continue
+            # without account all the accounts of the provider can be used,
+            # the worst breaker is shown
+            breaker = record._get_breakers().sorted(
+                key=lambda b: (severity[b.state], b.failure_count))[-1:]
+            record.breaker_state = breaker.state or 'closed'
+            record.breaker_failure_count = breaker.failure_count
+            record.breaker_opened_at = breaker.opened_at
+
+    @api.multi
+    def reset_breaker(self):
+        for record in self:
+            record._get_breakers().reset()
+        return True
 
     def _selection_capture_payment(self):
         return [
@@ -33,9 +72,7 @@ class AccountPaymentMode(models.Model):
             builder.build_registry(
                 components_registry,
                 states=('installed', 'to upgrade', 'to install'))
-        return [
-            (p._provider_name, p._provider_name.title())
-            for p in self.env['gateway.transaction']._get_all_provider()]
+        return self.env['gateway.transaction']._get_provider_selection()
 
     def _get_allowed_capture_method(self):
         transaction_obj = self.env['gateway.transaction']
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo import models
+
+
+class ComponentBuilder(models.AbstractModel):
+    _inherit = 'component.builder'
+
+    def _register_hook(self):
+        res = super(ComponentBuilder, self)._register_hook()
+        # the providers are only known once the components are built
+        self.env['gateway.transaction']._create_job_channels()
+        return res
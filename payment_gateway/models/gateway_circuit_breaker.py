@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from contextlib import contextmanager
+from odoo import _, api, fields, models
+from odoo.addons.payment_gateway.exceptions import ProviderUnavailable
+import logging
+_logger = logging.getLogger(__name__)
+
+BREAKER_STATES = [
+    ('closed', 'Closed'),
+    ('open', 'Open'),
+    ('half_open', 'Half Open'),
+    ]
+
+
+class GatewayCircuitBreaker(models.Model):
+    """
+    Circuit breaker of the provider accounts. The outages are counted
+    for all the workers, when a provider is down the calls fail fast
+    instead of waiting for the timeout of the provider
+    """
+    _name = 'gateway.circuit.breaker'
+    _description = 'Gateway Circuit Breaker'
+    _log_access = False
+
+    provider = fields.Char(required=True)
+    account_id = fields.Many2one(
+        'keychain.account',
+        'Account',
+        required=True,
+        ondelete='cascade')
+    state = fields.Selection(
+        BREAKER_STATES, required=True, default='closed')
+    failure_count = fields.Integer()
+    probe_count = fields.Integer()
+    opened_at = fields.Datetime()
+
+    _sql_constraints = [
+        ('account_uniq', 'unique(provider, account_id)',
+         'An account can only have one circuit breaker'),
+    ]
+
+    @contextmanager
+    def _breaker_cursor(self):
+        """The breakers are updated in their own transaction, so the
+        other workers see the outage immediately.
+        The tests patch this method to keep using the test cursor"""
+        with self.env.registry.cursor() as cr:
+            yield cr
+
+    @api.model
+    def _acquire(self, provider, account_id, open_delay, probe_limit):
+        """
+        Check that a call to the provider account is allowed, when the
+        breaker have been open for open_delay seconds, probe_limit calls
+        are allowed to test the provider
+        :return: bool, True if the result of the call must be recorded
+        :raise: ProviderUnavailable if the call is not allowed
+        """
+        # most of the calls are done on a healthy provider, the row is
+        # only locked when the breaker have to be checked or updated
+        with self._breaker_cursor() as cr:
+            cr.execute("""
+                SELECT state, failure_count
+                FROM gateway_circuit_breaker
+                WHERE provider = %s AND account_id = %s
+                """, (provider, account_id))
+            row = cr.fetchone()
+        if not row or row == ('closed', 0):
+            return False
+        with self._breaker_cursor() as cr:
+            cr.execute("""
+                SELECT state, failure_count, probe_count,
+                    opened_at + %s * interval '1 second'
+                        <= (now() at time zone 'UTC')
+                FROM gateway_circuit_breaker
+                WHERE provider = %s AND account_id = %s
+                FOR UPDATE
+                """, (open_delay, provider, account_id))
+            row = cr.fetchone()
+            if not row:
+                return False
+            state, failure_count, probe_count, expired = row
+            if state == 'closed':
+                return failure_count > 0
+            if state == 'open' and expired:
+                state, probe_count = 'half_open', 0
+            if state == 'open' or probe_count >= probe_limit:
+                raise ProviderUnavailable(
+                    _('The provider %s is unavailable, please retry later')
+                    % provider)
+            cr.execute("""
+                UPDATE gateway_circuit_breaker
+                SET state = %s, probe_count = %s
+                WHERE provider = %s AND account_id = %s
+                """, (state, probe_count + 1, provider, account_id))
+            return True
+
+    @api.model
+    def _record_failure(self, provider, account_id, threshold):
+        """
+        Count an outage of the provider account, the breaker is open
+        after threshold consecutive outages or on the failure of a probe
+        """
+        with self._breaker_cursor() as cr:
+            cr.execute("""
+                INSERT INTO gateway_circuit_breaker
+                    (provider, account_id, state, failure_count, probe_count)
+                VALUES (%s, %s, 'closed', 1, 0)
+                ON CONFLICT (provider, account_id) DO UPDATE SET
+                    failure_count = gateway_circuit_breaker.failure_count + 1
+                RETURNING state, failure_count
+                """, (provider, account_id))
+            state, failure_count = cr.fetchone()
+            if state == 'half_open' or (
+                    state == 'closed' and failure_count >= threshold):
+                cr.execute("""
+                    UPDATE gateway_circuit_breaker
+                    SET state = 'open', probe_count = 0,
+                        opened_at = now() at time zone 'UTC'
+                    WHERE provider = %s AND account_id = %s
+                    """, (provider, account_id))
+                _logger.warning(
+                    'Circuit breaker of %s account %s is open after %s '
+                    'failures', provider, account_id, failure_count)
+
+    @api.model
+    def _record_success(self, provider, account_id):
+        with self._breaker_cursor() as cr:
+            cr.execute("""
+                UPDATE gateway_circuit_breaker
+                SET state = 'closed', failure_count = 0, probe_count = 0,
+                    opened_at = NULL
+                WHERE provider = %s AND account_id = %s
+                    AND (state != 'closed' OR failure_count > 0)
+                RETURNING state
+                """, (provider, account_id))
+            if cr.fetchone():
+                _logger.info(
+                    'Circuit breaker of %s account %s is closed',
+                    provider, account_id)
+
+    @api.multi
+    def reset(self):
+        return self.write({
+            'state': 'closed',
+            'failure_count': 0,
+            'probe_count': 0,
+            'opened_at': False,
+            })
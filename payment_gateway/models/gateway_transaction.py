@@ -3,28 +3,88 @@
 # @author Sébastien BEAU <sebastien.beau@akretion.com>
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
+from collections import defaultdict
 from contextlib import contextmanager
-from datetime import datetime
+from datetime import datetime, timedelta
 from odoo import _, api, fields, models
 import odoo.addons.decimal_precision as dp
 from odoo.addons.component.core import WorkContext
-from odoo.addons.queue_job.job import job
+from odoo.addons.component.exception import NoComponentError
+from odoo.addons.payment_gateway.exceptions import ProviderUnavailable
+from odoo.addons.payment_gateway.fields import (
+    Jsonb,
+    JSONB_OPERATORS,
+    json_load,
+    jsonb_condition)
+from odoo.addons.queue_job.job import identity_exact, job
 from odoo.exceptions import UserError
+from multiprocessing.pool import ThreadPool
+import json
+import logging
+import time
+import weakref
+_logger = logging.getLogger(__name__)
+
+# provider selection by component registry, dropped when the registry
+# is rebuilt
+_provider_cache = weakref.WeakKeyDictionary()
+
+
+def _get_provider_cache(components_registry):
+    cache = _provider_cache.get(components_registry)
+    if cache is None:
+        cache = {'selection': None}
+        if getattr(components_registry, 'ready', True):
+            _provider_cache[components_registry] = cache
+    return cache
 
 
 class GatewayTransaction(models.Model):
     _name = 'gateway.transaction'
     _description = 'Gateway Transaction'
     _order = 'create_date desc'
+    _capture_chunk_size = 100
+    # delay in seconds between two checks of a pending transaction,
+    # doubled at each attempt
+    _check_state_base_delay = 60
+    _check_state_max_delay = 3600
+    # the pending transactions stay locked during the calls to the
+    # providers, a small batch keeps the webhooks on them from waiting
+    _check_state_limit = 100
+    # number of requests sent at the same time by generate_multi
+    _generate_concurrency = 8
+    # kinds of jobs having a queue channel by provider
+    _job_channel_kinds = ('webhook', 'capture')
+    # number of seconds before processing again a webhook event or a
+    # capture when another job is processing the same transaction
+    _webhook_lock_retry = 5
+    # json fields that can be searched with a path or a json operator
+    # {field name: (table, column returning the transaction id, column)}
+    _jsonb_search_fields = {
+        'meta': ('gateway_transaction', 'id', 'meta'),
+        'data': ('gateway_transaction_payload', 'transaction_id', 'data'),
+        }
 
     @contextmanager
     @api.multi
     def _get_provider(self, provider_name=None):
-        provider_name = provider_name or self.payment_mode_id.provider
+        provider_name = provider_name or self.provider
         if not provider_name:
             raise UserError(_('Provider name is missing'))
         work = WorkContext(model_name=self._name, collection=self)
-        yield work.component_by_name('payment.service.%s' % provider_name)
+        yield self._get_provider_class(work, provider_name)(work)
+
+    @api.model
+    def _get_provider_class(self, work, provider_name):
+        name = 'payment.service.%s' % provider_name
+        component_class = work.components_registry.get(name)
+        if component_class is None:
+            raise NoComponentError("No component found for name '%s'" % name)
+        if not component_class._component_match(work):
+            raise NoComponentError(
+                "Component with name '%s' can't be used for model '%s'"
+                % (component_class._name, work.model_name))
+        return component_class
 
     @api.model
     def _get_all_provider(self):
@@ -32,20 +92,66 @@ class GatewayTransaction(models.Model):
         return [provider for provider in work.many_components(
                 usage='gateway.provider')]
 
+    @api.model
+    def _get_provider_selection(self):
+        work = WorkContext(model_name=self._name, collection=self)
+        cache = _get_provider_cache(work.components_registry)
+        if cache['selection'] is None:
+            cache['selection'] = [
+                (p._provider_name, p._provider_name.title())
+                for p in work.many_components(usage='gateway.provider')]
+        return list(cache['selection'])
+
+    @api.model
+    def _get_job_channel(self, kind, provider_name):
+        """Return the queue channel of the jobs of this kind for the
+        provider, so the backlog of a provider do not delay the others"""
+        return 'root.gateway.%s.%s' % (kind, provider_name)
+
+    @api.model
+    def _create_job_channels(self):
+        """Create the queue channels of each provider, their capacity is
+        set in the channels option of the job runner"""
+        function_obj = self.env['queue.job.function'].sudo()
+        for provider_name, label in self._get_provider_selection():
+            for kind in self._job_channel_kinds:
+                function_obj._find_or_create_channel(
+                    self._get_job_channel(kind, provider_name))
+
+    @api.model
+    def _try_lock_external_id(self, provider_name, external_id):
+        """Lock the transaction until the end of the database transaction
+        so the jobs on a same transaction are serialized
+        :return: False if the transaction is locked by another worker"""
+        self.env.cr.execute(
+            'SELECT pg_try_advisory_xact_lock(hashtext(%s), hashtext(%s))',
+            (provider_name, external_id))
+        return self.env.cr.fetchone()[0]
+
     @api.model
     def _selection_capture_payment(self):
         return self.env['account.payment.mode']._selection_capture_payment()
 
+    @api.model
+    def _selection_provider(self):
+        return self.env['account.payment.mode']._selection_provider()
+
     name = fields.Char()
     payment_mode_id = fields.Many2one(
         'account.payment.mode',
         'Gateway')
+    provider = fields.Selection(
+        selection='_selection_provider',
+        related='payment_mode_id.provider',
+        store=True,
+        readonly=True,
+        index=True)
     external_id = fields.Char(index=True)
     capture_payment = fields.Selection(
         selection="_selection_capture_payment",
         required=True)
     url = fields.Char()
-    meta = fields.Serialized()
+    meta = Jsonb()
     amount = fields.Float(dp=dp.get_precision('Account'))
     currency_id = fields.Many2one(
         'res.currency',
@@ -88,8 +194,18 @@ class GatewayTransaction(models.Model):
             "- Abandoned: The Customer didn't fill the payment information\n"
             "- Succeeded: The money is here, life is beautiful\n")
         )
-    data = fields.Text()
-    error = fields.Text()
+    payload_ids = fields.One2many(
+        'gateway.transaction.payload',
+        'transaction_id',
+        'Payload')
+    data = fields.Text(
+        compute='_compute_payload',
+        inverse='_inverse_payload',
+        search='_search_data')
+    error = fields.Text(
+        compute='_compute_payload',
+        inverse='_inverse_payload',
+        search='_search_error')
     date_processing = fields.Datetime('Processing Date')
     risk_level = fields.Selection([
         ('unknown', 'Unknown'),
@@ -101,6 +217,53 @@ class GatewayTransaction(models.Model):
     redirect_success_url = fields.Char()
     used_3d_secure = fields.Boolean(
         help="Tic if this transaction have used 3d secure")
+    check_state_count = fields.Integer(
+        help="Number of time the state have been checked by the scheduler")
+    date_next_check = fields.Datetime(
+        'Next State Check',
+        help="Date of the next state check by the scheduler")
+
+    def init(self):
+        self._cr.execute("""
+            SELECT indexname FROM pg_indexes
+            WHERE indexname = 'gateway_transaction_meta_gin_index'
+            """)
+        if not self._cr.fetchone():
+            self._cr.execute("""
+                CREATE INDEX gateway_transaction_meta_gin_index
+                ON gateway_transaction USING gin (meta jsonb_path_ops)
+                """)
+        # used to find the current transaction of the origins
+        self._cr.execute("""
+            SELECT indexname FROM pg_indexes
+            WHERE indexname = 'gateway_transaction_res_model_res_id_id_index'
+            """)
+        if not self._cr.fetchone():
+            self._cr.execute("""
+                CREATE INDEX gateway_transaction_res_model_res_id_id_index
+                ON gateway_transaction (res_model, res_id, id)
+                """)
+        # webhook and return lookup are done on the provider and external id
+        self._cr.execute("""
+            SELECT indexname FROM pg_indexes
+            WHERE indexname = 'gateway_transaction_provider_external_id_index'
+            """)
+        if not self._cr.fetchone():
+            self._cr.execute("""
+                CREATE INDEX gateway_transaction_provider_external_id_index
+                ON gateway_transaction (provider, external_id)
+                """)
+        # the scheduler only look at the pending transactions
+        self._cr.execute("""
+            SELECT indexname FROM pg_indexes
+            WHERE indexname = 'gateway_transaction_pending_check_index'
+            """)
+        if not self._cr.fetchone():
+            self._cr.execute("""
+                CREATE INDEX gateway_transaction_pending_check_index
+                ON gateway_transaction (date_next_check, create_date)
+                WHERE state = 'pending'
+                """)
 
     @api.multi
     @api.depends('origin_id')
@@ -109,6 +272,80 @@ class GatewayTransaction(models.Model):
             record.res_id = record.origin_id.id
             record.res_model = record.origin_id._name
 
+    @api.multi
+    @api.depends('payload_ids.data', 'payload_ids.error')
+    def _compute_payload(self):
+        for record in self:
+            payload = record.payload_ids[:1]
+            data = payload.data
+            if data and not isinstance(data, basestring):
+                # a string is a legacy text kept as is by the migration
+                data = json.dumps(data)
+            record.data = data or False
+            record.error = payload.error or False
+
+    @api.multi
+    def _inverse_payload(self):
+        for record in self:
+            data = record.data
+            if data:
+                # a text that is not a json is kept as a json string
+                data = json_load(data)
+            vals = {'data': data or False, 'error': record.error}
+            if record.payload_ids:
+                record.payload_ids[:1].write(vals)
+            elif record.data or record.error:
+                vals['transaction_id'] = record.id
+                record.payload_ids.create(vals)
+
+    @api.model
+    def _search_data(self, operator, value):
+        return self._search_payload('data', operator, value)
+
+    @api.model
+    def _search_error(self, operator, value):
+        return self._search_payload('error', operator, value)
+
+    @api.model
+    def _search_payload(self, name, operator, value):
+        """
+        Search the transactions on the text of their payload, the paths
+        of data are searched with the json operators (see _jsonb_leaf)
+        """
+        if value is False and operator in ('=', '!='):
+            # a transaction without payload have no data and no error
+            domain = [('payload_ids.%s' % name, '!=', False)]
+            return domain if operator == '!=' else ['!'] + domain
+        return [('payload_ids.%s' % name, operator, value)]
+
+    @api.model
+    def _jsonb_leaf(self, leaf):
+        """
+        Convert a leaf on a json field to an 'inselect' leaf on the id
+        so the json operators and path are pushed down into SQL
+        """
+        if not isinstance(leaf, (list, tuple)) or len(leaf) != 3 \
+                or not isinstance(leaf[0], basestring):
+            return leaf
+        path = leaf[0].split('.')
+        name = path.pop(0)
+        operator, value = leaf[1], leaf[2]
+        if name not in self._jsonb_search_fields or not (
+                path or operator in JSONB_OPERATORS or (
+                    operator == '=' and isinstance(value, (dict, list)))):
+            return leaf
+        table, id_column, column = self._jsonb_search_fields[name]
+        condition, params = jsonb_condition(column, path, operator, value)
+        query = 'SELECT %s FROM %s WHERE %s' % (id_column, table, condition)
+        return ('id', 'inselect', (query, params))
+
+    @api.model
+    def _where_calc(self, domain, active_test=True):
+        if domain:
+            domain = [self._jsonb_leaf(leaf) for leaf in domain]
+        return super(GatewayTransaction, self)._where_calc(
+            domain, active_test=active_test)
+
     @api.multi
     def _get_amount_to_capture(self):
         """
@@ -126,9 +363,47 @@ class GatewayTransaction(models.Model):
     def set_back_to_capture(self):
         return self.write({'state': 'to_capture'})
 
+    @api.multi
+    def _get_origins(self):
+        """
+        :return: dict {model name: origin recordset}
+        """
+        ids_by_model = defaultdict(set)
+        for record in self:
+            if record.res_model and record.res_id:
+                ids_by_model[record.res_model].add(record.res_id)
+        return {
+            model: self.env[model].browse(list(ids))
+            for model, ids in ids_by_model.items()
+            }
+
+    @api.model
+    def create(self, vals):
+        record = super(GatewayTransaction, self).create(vals)
+        if record.origin_id and not self._context.get(
+                'defer_current_transaction'):
+            # a new transaction is always the more recent one
+            record.origin_id._set_current_transaction(record)
+        return record
+
+    @api.multi
+    def unlink(self):
+        origins = self._get_origins()
+        result = super(GatewayTransaction, self).unlink()
+        for origin in origins.values():
+            origin.exists()._refresh_current_transaction()
+        return result
+
     @api.multi
     def write(self, vals):
+        if 'origin_id' in vals:
+            origins = self._get_origins()
         result = super(GatewayTransaction, self).write(vals)
+        if 'origin_id' in vals:
+            for model, origin in self._get_origins().items():
+                origins[model] = origins.get(model, origin) | origin
+            for origin in origins.values():
+                origin._refresh_current_transaction()
         if vals.get('state') == 'to_capture':
             immediate_records = self.filtered(
                 lambda r: r.capture_payment == 'immediately')
@@ -161,12 +436,124 @@ class GatewayTransaction(models.Model):
         """
         vals = self._prepare_transaction(origin, **kwargs)
         transaction = self.create(vals)
-        if transaction.origin_id:
-            transaction.origin_id._compute_current_transaction()
         with transaction._get_provider(provider_name) as provider:
             provider.generate(**kwargs)
         return transaction
 
+    @api.model
+    def generate_multi(self, provider_name, origins, **kwargs):
+        """
+        Generate the transactions of several origins, the requests to the
+        provider backend are sent concurrently by a pool of threads.
+        A transaction whose creation failed is set to failed instead of
+        raising the error
+        :param provider_name: str
+        :param origins: target recordset
+        :param kwargs: dict
+        :return: self recordset
+        """
+        # create do not take a list of values in this version, the current
+        # transaction of the origins is refreshed once for all of them
+        transactions = self.browse()
+        for origin in origins:
+            vals = self._prepare_transaction(origin, **kwargs)
+            transactions |= self.with_context(
+                defer_current_transaction=True).create(vals)
+        for origin in transactions._get_origins().values():
+            origin._refresh_current_transaction()
+
+        calls = {}
+        tokens = {}
+        errors = {}
+        for transaction in transactions:
+            with transaction._get_provider(provider_name) as provider:
+                try:
+                    with self.env.cr.savepoint():
+                        calls[transaction.id] =\
+                            provider._prepare_create_transaction(**kwargs)
+                        if calls[transaction.id] is not None:
+                            tokens[transaction.id] =\
+                                provider._breaker_acquire()
+                except Exception as e:
+                    _logger.info(
+                        'Fail to prepare transaction %s: %s',
+                        transaction.id, e)
+                    errors[transaction.id] =\
+                        provider._get_creation_error_message(e)
+
+        results = self._run_concurrently({
+            transaction_id: calls[transaction_id]
+            for transaction_id in tokens})
+        for transaction in transactions:
+            if transaction.id in errors:
+                continue
+            with transaction._get_provider(provider_name) as provider:
+                try:
+                    with self.env.cr.savepoint():
+                        if transaction.id in results:
+                            result, error, duration = results[
+                                transaction.id]
+                            provider._breaker_release(
+                                tokens[transaction.id], error)
+                            provider._record_call(
+                                'generate',
+                                error and provider._get_call_result(error)
+                                or 'success',
+                                duration)
+                            if error:
+                                raise error
+                        else:
+                            with provider._call_provider('generate'):
+                                result = provider._create_transaction(
+                                    **kwargs)
+                        # the results hold the external id and the data of
+                        # each transaction, only the errors are shared
+                        provider._write_creation_result(result, **kwargs)
+                except Exception as e:
+                    _logger.info(
+                        'Fail to generate transaction %s: %s',
+                        transaction.id, e)
+                    transaction.invalidate_cache()
+                    errors[transaction.id] =\
+                        provider._get_creation_error_message(e)
+
+        ids_by_error = defaultdict(list)
+        for transaction_id, error in errors.items():
+            ids_by_error[error].append(transaction_id)
+        for error, ids in ids_by_error.items():
+            self.browse(ids).write({'state': 'failed', 'error': error})
+        return transactions
+
+    @api.model
+    def _run_concurrently(self, calls):
+        """
+        Run the functions in a pool of threads
+        :param calls: dict {key: function without argument}
+        :return: dict {key: (result, exception, duration)}
+        """
+        if not calls:
+            return {}
+        concurrency = int(self.env['ir.config_parameter'].sudo().get_param(
+            'payment_gateway.generate_concurrency',
+            self._generate_concurrency))
+
+        def run(call):
+            start = time.time()
+            try:
+                return call(), None, time.time() - start
+            except Exception as e:
+                return None, e, time.time() - start
+
+        pool = ThreadPool(max(min(concurrency, len(calls)), 1))
+        try:
+            keys = list(calls)
+            results = pool.map(run, [calls[key] for key in keys])
+        finally:
+            pool.close()
+            pool.join()
+        return dict(zip(keys, results))
+
+    @job(default_channel='root.gateway.capture')
     @api.multi
     def capture(self):
         """
@@ -181,11 +568,28 @@ class GatewayTransaction(models.Model):
         vals = {}
         if self.state == 'succeeded':
             pass
+        elif self.external_id and not self._try_lock_external_id(
+                self.provider, self.external_id):
+            # a webhook job is refreshing the transaction, the capture is
+            # done again once the job is done
+            _logger.info(
+                'Capture of transaction %s delayed: locked', self.id)
+            self._delay_capture(self._webhook_lock_retry)
+            return False
         else:
             try:
                 with self._get_provider() as provider:
-                    provider.capture()
+                    retry_delay = provider._breaker_open_delay
+                    with provider._call_provider('capture'):
+                        provider.capture()
                 vals = {'date_processing': datetime.now()}
+            except ProviderUnavailable, e:
+                # the transaction is captured again when the circuit
+                # breaker let the calls to the provider go through
+                _logger.warning(
+                    'Capture of transaction %s delayed: %s', self.id, e.name)
+                self._delay_capture(retry_delay)
+                return False
             except Exception, e:
                 vals = {
                     'state': 'failed',
@@ -195,14 +599,265 @@ class GatewayTransaction(models.Model):
             self.write(vals)
         return vals.get('state') == 'succeeded'
 
+    @api.multi
+    def _delay_capture(self, seconds):
+        """
+        Capture the transactions again in a new job
+        :param seconds: int, delay before the capture
+        :return: the delayed job
+        """
+        return self.with_delay(
+            eta=seconds,
+            channel=self._get_job_channel('capture', self[0].provider),
+            identity_key=identity_exact,
+            description=_('Capture %s %s transactions') % (
+                len(self), self[0].provider)
+            ).capture_chunk()
+
+    @api.multi
+    def _group_by_provider_account(self):
+        """
+        Group the transactions by provider and provider account
+        :return: dict {(provider, account_id): [transaction ids]}
+        """
+        groups = defaultdict(list)
+        for record in self:
+            account = record.payment_mode_id.provider_account
+            groups[(record.provider, account.id)].append(record.id)
+        return groups
+
+    @api.multi
+    def capture_batch(self, chunk_size=None):
+        """
+        Capture the transactions asynchronously.
+        Transactions are split in chunks sharing the same provider account
+        and each chunk is captured in its own job, so the captures are
+        spread over the queue workers
+        :param chunk_size: int, number of transactions per job
+        :return: list of the delayed jobs
+        """
+        chunk_size = chunk_size or self._capture_chunk_size
+        jobs = []
+        groups = self._group_by_provider_account()
+        for (provider, account_id), ids in groups.items():
+            for start in range(0, len(ids), chunk_size):
+                chunk = self.browse(ids[start:start + chunk_size])
+                jobs.append(chunk.with_delay(
+                    channel=self._get_job_channel('capture', provider),
+                    description=_('Capture %s %s transactions') % (
+                        len(chunk), provider)
+                    ).capture_chunk())
+        return jobs
+
+    @job(default_channel='root.gateway.capture')
+    @api.multi
+    def capture_chunk(self):
+        """
+        Capture the transactions one by one, each capture is done in its
+        own savepoint so a failure do not roll back the other captures
+        :return: dict {transaction id: {'state': state, 'error': error}}
+        """
+        result = {}
+        for record in self:
+            try:
+                with self.env.cr.savepoint():
+                    record.capture()
+                result[record.id] = {
+                    'state': record.state,
+                    'error': record.error,
+                    }
+            except Exception as e:
+                _logger.exception('Fail to capture transaction %s', record.id)
+                record.invalidate_cache()
+                result[record.id] = {
+                    'state': record.state,
+                    'error': str(e),
+                    }
+        return result
+
     @api.multi
     def check_state(self):
+        """
+        Refresh the state of the pending transactions, the states are
+        fetched in bulk for each provider account
+        """
+        pending = self.filtered(lambda r: r.state == 'pending')
+        groups = pending._group_by_provider_account()
+        for (provider_name, account_id), ids in groups.items():
+            transactions = self.browse(ids)
+            with transactions._get_provider(provider_name) as provider:
+                with provider._call_provider('get_state'):
+                    states = provider.get_states()
+            transactions._write_states(states)
+
+    @api.multi
+    def _write_states(self, states):
+        """
+        Write the new states with one write per state
+        :param states: dict {transaction id: state}
+        """
+        ids_by_state = defaultdict(list)
         for record in self:
-            if record.state == 'pending':
-                with record._get_provider() as provider:
-                    record.write({'state': provider.get_state()})
+            state = states.get(record.id)
+            if state and state != record.state:
+                ids_by_state[state].append(record.id)
+        for state, ids in ids_by_state.items():
+            self.browse(ids).write({'state': state})
+
+    @api.model
+    def _enqueue_webhook(self, provider_name, method_name, params,
+                         payload=None, headers=None):
+        """
+        Delay the processing of the event received by the webhook,
+        an event already received is ignored
+        :param payload: raw body of the request, to verify the signature
+        :param headers: headers of the request, to verify the signature
+        :return: the delayed job or None
+        """
+        with self._get_provider(provider_name) as provider:
+            event_key = provider._get_webhook_event_key(method_name, params)
+            external_id = provider._get_webhook_external_id(
+                method_name, params)
+            verified = payload is not None and provider._verify_webhook(
+                method_name, payload, headers or {})
+        event_obj = self.env['gateway.webhook.event']
+        if not event_obj._register(provider_name, event_key):
+            _logger.info(
+                'Event %s from %s already received', event_key, provider_name)
+            return None
+        if verified:
+            # the content of the event is applied, so it is not coalesced
+            # with the other events of the transaction
+            return self.with_delay(
+                channel=self._get_job_channel('webhook', provider_name),
+                identity_key='gateway-webhook-%s-%s' % (
+                    provider_name, event_key),
+                ).process_webhook(
+                    provider_name, method_name, params, verified=True)
+        if external_id:
+            # the events on the same transaction received during the delay
+            # are coalesced in one job, as the job refresh the transaction
+            delay = int(self.env['ir.config_parameter'].sudo().get_param(
+                'payment_gateway.webhook_coalesce_delay', 2))
+            return self.with_delay(
+                eta=delay,
+                channel=self._get_job_channel('webhook', provider_name),
+                identity_key='gateway-webhook-%s-transaction-%s' % (
+                    provider_name, external_id),
+                ).process_webhook(provider_name, method_name, params)
+        return self.with_delay(
+            channel=self._get_job_channel('webhook', provider_name),
+            identity_key='gateway-webhook-%s-%s' % (provider_name, event_key)
+            ).process_webhook(provider_name, method_name, params)
 
     @job(default_channel='root.gateway.webhook')
-    def process_webhook(self, provider_name, method_name, params):
+    def process_webhook(self, provider_name, method_name, params,
+                        verified=False):
         with self._get_provider(provider_name) as provider:
-            return provider.dispatch(method_name, params)
+            external_id = provider._get_webhook_external_id(
+                method_name, params)
+            if external_id and not self._try_lock_external_id(
+                    provider_name, external_id):
+                # the event is processed again in a new job, so the
+                # contention is not counted in the retries of the job
+                self.with_delay(
+                    eta=self._webhook_lock_retry,
+                    channel=self._get_job_channel('webhook', provider_name),
+                    ).process_webhook(
+                        provider_name, method_name, params,
+                        verified=verified)
+                return _('Transaction %s is processed by another job, '
+                         'the event is delayed') % external_id
+            with provider._measure('process_webhook'):
+                return provider.dispatch(
+                    method_name, params, verified=verified)
+
+    @api.model
+    def _lock_transaction_to_check(self, now, limit):
+        """
+        Return the pending transactions to check. The rows are locked and
+        the rows already locked are skipped so several workers can
+        process the pending transactions in parallel
+        """
+        first_check = now - timedelta(seconds=self._check_state_base_delay)
+        self._cr.execute("""
+            SELECT id FROM gateway_transaction
+            WHERE state = 'pending'
+                AND (date_next_check <= %s
+                     OR (date_next_check IS NULL AND create_date <= %s))
+            ORDER BY date_next_check NULLS FIRST, create_date
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+            """, (fields.Datetime.to_string(now),
+                  fields.Datetime.to_string(first_check),
+                  limit))
+        return self.browse([row[0] for row in self._cr.fetchall()])
+
+    @api.multi
+    def _abandon_expired(self, now):
+        """
+        Abandon the transactions pending for longer than the timeout
+        of their provider, the transactions of a missing or uninstalled
+        provider are skipped and checked again later
+        :return: the transactions not expired to check
+        """
+        expired = skipped = self.browse()
+        groups = self._group_by_provider_account()
+        for (provider_name, account_id), ids in groups.items():
+            transactions = self.browse(ids)
+            try:
+                with transactions._get_provider(provider_name) as provider:
+                    timeout = provider._pending_timeout
+            except (NoComponentError, UserError) as e:
+                _logger.warning(
+                    'Check of the transactions %s skipped, provider %s '
+                    'not found: %s', ids, provider_name, e)
+                skipped |= transactions
+                continue
+            limit = fields.Datetime.to_string(now - timedelta(hours=timeout))
+            expired |= transactions.filtered(lambda r: r.create_date < limit)
+        expired.write({'state': 'abandoned'})
+        skipped._schedule_next_check(now)
+        return self - expired - skipped
+
+    @api.multi
+    def _schedule_next_check(self, now):
+        """
+        Postpone the next check with an exponential backoff
+        """
+        ids_by_count = defaultdict(list)
+        for record in self:
+            ids_by_count[record.check_state_count].append(record.id)
+        for count, ids in ids_by_count.items():
+            delay = min(
+                self._check_state_base_delay * 2 ** count,
+                self._check_state_max_delay)
+            self.browse(ids).write({
+                'check_state_count': count + 1,
+                'date_next_check': fields.Datetime.to_string(
+                    now + timedelta(seconds=delay)),
+                })
+
+    @api.model
+    def _cron_check_pending_state(self, limit=None):
+        now = datetime.now()
+        transactions = self._lock_transaction_to_check(
+            now, limit or self._check_state_limit)
+        transactions = transactions._abandon_expired(now)
+        groups = transactions._group_by_provider_account()
+        for (provider_name, account_id), ids in groups.items():
+            try:
+                with self._cr.savepoint():
+                    self.browse(ids).check_state()
+            except ProviderUnavailable as e:
+                _logger.info('Check of %s transactions delayed: %s',
+                             provider_name, e.name)
+                transactions.invalidate_cache()
+            except Exception:
+                _logger.exception(
+                    'Fail to check the state of %s transactions',
+                    provider_name)
+                transactions.invalidate_cache()
+        transactions.filtered(
+            lambda r: r.state == 'pending')._schedule_next_check(now)
+        return True
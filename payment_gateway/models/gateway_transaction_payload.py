@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo import fields, models
+from odoo.addons.payment_gateway.fields import Jsonb
+
+
+class GatewayTransactionPayload(models.Model):
+    """
+    Raw data exchanged with the provider for a transaction.
+    They are kept outside of the gateway.transaction table so the
+    list, search and read of the transactions do not load them.
+    """
+    _name = 'gateway.transaction.payload'
+    _description = 'Gateway Transaction Payload'
+    _log_access = False
+
+    transaction_id = fields.Many2one(
+        'gateway.transaction',
+        'Transaction',
+        required=True,
+        ondelete='cascade',
+        index=True)
+    data = Jsonb()
+    error = fields.Text()
+
+    _sql_constraints = [
+        ('transaction_uniq', 'unique(transaction_id)',
+         'A transaction can only have one payload'),
+    ]
+
+    def init(self):
+        self._cr.execute("""
+            SELECT indexname FROM pg_indexes
+            WHERE indexname = 'gateway_transaction_payload_data_gin_index'
+            """)
+        if not self._cr.fetchone():
+            self._cr.execute("""
+                CREATE INDEX gateway_transaction_payload_data_gin_index
+                ON gateway_transaction_payload USING gin (data jsonb_path_ops)
+                """)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from datetime import datetime, timedelta
+from odoo import api, fields, models
+
+
+class GatewayWebhookEvent(models.Model):
+    """
+    Events received by the webhooks, used to ignore the events
+    delivered again by the providers
+    """
+    _name = 'gateway.webhook.event'
+    _description = 'Gateway Webhook Event'
+    _log_access = False
+    _order = 'date desc'
+    _keep_days = 7
+
+    provider = fields.Char(required=True)
+    event_key = fields.Char(required=True)
+    date = fields.Datetime(required=True, default=fields.Datetime.now)
+
+    _sql_constraints = [
+        ('event_uniq', 'unique(provider, event_key)',
+         'The event have already been received'),
+    ]
+
+    @api.model
+    def _register(self, provider, event_key):
+        """
+        Register the event
+        :return: bool, False if the event have already been received
+        """
+        self._cr.execute("""
+            INSERT INTO gateway_webhook_event (provider, event_key, date)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (provider, event_key) DO NOTHING
+            RETURNING id
+            """, (provider, event_key, fields.Datetime.now()))
+        return bool(self._cr.fetchone())
+
+    @api.model
+    def _cron_purge(self):
+        limit = datetime.now() - timedelta(days=self._keep_days)
+        self._cr.execute("""
+            DELETE FROM gateway_webhook_event WHERE date < %s
+            """, (fields.Datetime.to_string(limit),))
+        return True
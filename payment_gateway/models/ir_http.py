@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo import models
+from odoo.http import request, Response
+
+
+class IrHttp(models.AbstractModel):
+    _inherit = 'ir.http'
+
+    @classmethod
+    def _dispatch(cls):
+        response = super(IrHttp, cls)._dispatch()
+        # the json requests are always answered with json-rpc, the
+        # providers expecting a raw answer get it instead
+        raw_response = getattr(request, 'gateway_webhook_response', None)
+        if raw_response is not None:
+            return Response(raw_response, content_type='text/plain')
+        return response
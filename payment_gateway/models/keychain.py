@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo import api, models, tools
+
+
+class KeychainAccount(models.Model):
+    _inherit = 'keychain.account'
+
+    @api.model
+    @tools.ormcache('company_id', 'namespace', 'account_id', 'ttl_bucket')
+    def _get_gateway_credentials(
+            self, company_id, namespace, account_id, ttl_bucket):
+        """
+        Return the decrypted credentials of the account, the result is
+        cached until an account is modified or the ttl bucket change
+        :return: dict with the keys 'id', 'password' and 'data'
+        """
+        domain = [('namespace', '=', namespace)]
+        if account_id:
+            domain.append(('id', '=', account_id))
+        account = self.sudo().retrieve(domain)[0]
+        return {
+            'id': account.id,
+            'password': account._get_password(),
+            'data': account.get_data(),
+            }
+
+    # the caches are cleared once the accounts are modified, so a
+    # concurrent read can not cache the old credentials again
+
+    @api.model
+    def create(self, vals):
+        record = super(KeychainAccount, self).create(vals)
+        self.clear_caches()
+        return record
+
+    @api.multi
+    def write(self, vals):
+        result = super(KeychainAccount, self).write(vals)
+        self.clear_caches()
+        return result
+
+    @api.multi
+    def unlink(self):
+        result = super(KeychainAccount, self).unlink()
+        self.clear_caches()
+        return result
@@ -3,7 +3,6 @@
 # @author Sébastien BEAU <sebastien.beau@akretion.com>
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 from odoo import api, fields, models
-from odoo.fields import first
 
 
 class TransactionMixin(models.AbstractModel):
@@ -25,8 +24,8 @@ class TransactionMixin(models.AbstractModel):
     current_transaction_id = fields.Many2one(
         'gateway.transaction',
         'Current Transaction',
-        compute='_compute_current_transaction',
-        store=True,
+        readonly=True,
+        copy=False,
     )
 
     @api.multi
@@ -46,12 +45,34 @@ class TransactionMixin(models.AbstractModel):
                     transaction.capture(amount)
 
     @api.multi
-    @api.depends('transaction_ids')
-    def _compute_current_transaction(self):
+    def _set_current_transaction(self, transaction):
+        """
+        Set the current transaction without going through the write
+        (the pointer is maintained by the transactions)
+        """
+        self.sudo()._write({'current_transaction_id': transaction.id})
+        self.invalidate_cache(['current_transaction_id'], self.ids)
+
+    @api.multi
+    def _refresh_current_transaction(self):
+        """
+        Point to the more recent transaction, the transactions of all the
+        records are read with one query
+        """
+        if not self:
+            return
+        self._cr.execute("""
+            SELECT DISTINCT ON (res_id) res_id, id
+            FROM gateway_transaction
+            WHERE res_model = %s AND res_id IN %s
+            ORDER BY res_id, id DESC
+            """, (self._name, tuple(self.ids)))
+        current = dict(self._cr.fetchall())
+        transaction_obj = self.env['gateway.transaction']
         for record in self:
-            # Load the more recent transaction
-            record.current_transaction_id = first(
-                record.transaction_ids.sorted('id', reverse=True))
+            transaction = transaction_obj.browse(current.get(record.id))
+            if record.current_transaction_id != transaction:
+                record._set_current_transaction(transaction)
 
     def _get_transaction_name_based_on_origin(self):
         return self.name or ('%s with id %s' % (self._name, self.id))
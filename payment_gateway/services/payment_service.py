@@ -7,7 +7,24 @@ from odoo.addons.component.core import AbstractComponent
 from odoo.exceptions import UserError
 from odoo import _
 from odoo.osv import expression
+from odoo.addons.payment_gateway.exceptions import (
+    ProviderConnectionError,
+    ProviderUnavailable)
+from odoo.addons.payment_gateway.http_pool import (
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_TIMEOUT,
+    HTTP_SESSIONS)
+from odoo.addons.payment_gateway.metrics import METRICS
+from contextlib import contextmanager
+import hashlib
+import json
 import logging
+import requests
+import socket
+import threading
+import time
+import weakref
 _logger = logging.getLogger(__name__)
 
 try:
@@ -16,6 +33,12 @@ except ImportError:
     _logger.debug('Can not import cerberus')
 
 
+# Validators are cached by thread as a validator keep the state of the last
+# validation and by component registry so they are dropped when the
+# registry is rebuilt
+_validators = threading.local()
+
+
 class PaymentService(AbstractComponent):
     _name = 'payment.service'
     _description = 'Payment Service'
@@ -23,6 +46,19 @@ class PaymentService(AbstractComponent):
     _usage = 'gateway.provider'
     _allowed_capture_method = None
     _webhook_method = []
+    # answer the json webhook with the raw result of _get_webhook_response
+    _webhook_raw_response = False
+    _state_page_size = 100
+    # number of hours after which a pending transaction is abandoned
+    _pending_timeout = 24
+    # number of seconds the credentials of the account are cached
+    _credential_cache_ttl = 300
+    # number of consecutive outages opening the circuit breaker
+    _breaker_failure_threshold = 5
+    # number of seconds the circuit breaker stays open before testing
+    # the provider with _breaker_probe_limit calls
+    _breaker_open_delay = 60
+    _breaker_probe_limit = 3
 
     @property
     def _provider_name(self):
@@ -36,6 +72,17 @@ class PaymentService(AbstractComponent):
             raise NotImplementedError(validator_method)
         return getattr(self, validator_method)()
 
+    def _get_validator(self, method_name):
+        cache = getattr(_validators, 'cache', None)
+        if cache is None:
+            cache = _validators.cache = weakref.WeakKeyDictionary()
+        validators = cache.setdefault(self.work.components_registry, {})
+        key = (self._name, method_name)
+        if key not in validators:
+            schema = self._get_schema_for_method(method_name)
+            validators[key] = Validator(schema, purge_unknown=True)
+        return validators[key]
+
     def _secure_params(self, method, params):
         """
         This internal method is used to validate and sanitize the parameters
@@ -46,25 +93,58 @@ class PaymentService(AbstractComponent):
         :param params:
         :return:
         """
-        method_name = method.__name__
-        schema = self._get_schema_for_method(method_name)
-        v = Validator(schema, purge_unknown=True)
+        v = self._get_validator(method.__name__)
         if v.validate(params):
             return v.document
         _logger.error("BadRequest %s", v.errors)
         raise UserError(_('Invalid Form'))
 
-    def dispatch(self, method_name, params):
+    def dispatch(self, method_name, params, verified=False):
+        """Call the webhook method with the params of the event.
+        The event of a verified webhook is processed by the method
+        '{method_name}_verified' if the provider implements it"""
         if method_name not in self._webhook_method:
             raise UserError(_('Method not allowed for service %s'), self._name)
 
-        func = getattr(self, method_name, None)
+        func = None
+        if verified:
+            func = getattr(self, '%s_verified' % method_name, None)
+        func = func or getattr(self, method_name, None)
         if not func:
             raise UserError(_('Method %s not found in service %s'),
                             method_name, self._name)
         secure_params = self._secure_params(func, params)
         return func(**secure_params)
 
+    def _get_webhook_event_key(self, method_name, params):
+        """Return the key identifying the event received by the webhook.
+        By default it's the hash of the payload, inherit this method
+        if the provider send an event id"""
+        payload = json.dumps(params, sort_keys=True)
+        return hashlib.sha256('%s:%s' % (method_name, payload)).hexdigest()
+
+    def _get_webhook_response(self, method_name):
+        """Return the result of the json webhook once the event is
+        enqueued, inherit it if the provider expect a specific answer.
+        The result is sent as the raw body of the answer instead of a
+        json-rpc response if _webhook_raw_response is set"""
+        return True
+
+    def _verify_webhook(self, method_name, payload, headers):
+        """Return True if the signature of the event received by the
+        webhook is valid, the content of a verified event can then be
+        trusted without requesting the provider.
+        :param payload: raw body of the request
+        :param headers: headers of the request"""
+        return False
+
+    def _get_webhook_external_id(self, method_name, params):
+        """Return the external id of the transaction targeted by the
+        event received by the webhook. The events of a same transaction
+        are coalesced, return None if the processing of the event do not
+        only consist in refreshing the transaction"""
+        return None
+
     def _get_account(self):
         gateway = self.collection
         domain = []
@@ -77,11 +157,120 @@ class PaymentService(AbstractComponent):
         domain = expression.AND([domain, [('namespace', '=', namespace)]])
         return keychain.sudo().retrieve(domain)[0]
 
+    def _get_credentials(self):
+        """Return the credentials of the provider account, they are
+        cached by worker so they are only decrypted once
+        :return: dict with the keys 'id', 'password' and 'data'"""
+        mode = self.collection[:1].payment_mode_id
+        credentials = self.env['keychain.account']._get_gateway_credentials(
+            mode.company_id.id,
+            self._provider_name,
+            mode.provider_account.id,
+            int(time.time() // self._credential_cache_ttl))
+        return dict(credentials, data=dict(credentials['data']))
+
+    def _get_http_session(self):
+        """Return the pooled http session of the provider, it is shared
+        by all the services of the worker so the connections are reused.
+        Each provider must send its requests with this session"""
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        return HTTP_SESSIONS.get(
+            self._provider_name,
+            pool_size=int(get_param(
+                'payment_gateway.http_pool_size', DEFAULT_POOL_SIZE)),
+            keep_alive=get_param(
+                'payment_gateway.http_keep_alive', 'True') != 'False',
+            timeout=(
+                float(get_param(
+                    'payment_gateway.http_connect_timeout',
+                    DEFAULT_CONNECT_TIMEOUT)),
+                float(get_param(
+                    'payment_gateway.http_timeout', DEFAULT_TIMEOUT))))
+
+    def _is_outage_error(self, error):
+        """Return True if the error means that the provider is down,
+        inherit this method to add the errors of the provider library"""
+        return isinstance(error, (
+            ProviderConnectionError,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            socket.error))
+
+    def _breaker_acquire(self):
+        """Check that the circuit breaker of the provider account allow
+        the call, raise ProviderUnavailable otherwise
+        :return: the token to give to _breaker_release"""
+        account_id = self._get_credentials()['id']
+        return account_id, self.env['gateway.circuit.breaker'].sudo()\
+            ._acquire(self._provider_name, account_id,
+                      self._breaker_open_delay, self._breaker_probe_limit)
+
+    def _breaker_release(self, token, error=None):
+        """Record the result of the call on the circuit breaker"""
+        account_id, record = token
+        breaker = self.env['gateway.circuit.breaker'].sudo()
+        if error is not None and self._is_outage_error(error):
+            breaker._record_failure(
+                self._provider_name, account_id,
+                self._breaker_failure_threshold)
+        elif record:
+            breaker._record_success(self._provider_name, account_id)
+
+    @contextmanager
+    def _call_provider(self, operation):
+        """Protect the calls to the provider with the circuit breaker
+        of the provider account and record their metrics"""
+        with self._measure(operation):
+            token = self._breaker_acquire()
+            try:
+                yield
+            except Exception as e:
+                self._breaker_release(token, e)
+                raise
+            self._breaker_release(token)
+
+    @contextmanager
+    def _measure(self, operation):
+        """Record the duration and the result of the operation"""
+        start = time.time()
+        try:
+            yield
+        except Exception as e:
+            self._record_call(
+                operation, self._get_call_result(e), time.time() - start)
+            raise
+        self._record_call(operation, 'success', time.time() - start)
+
+    def _get_call_result(self, error):
+        if isinstance(error, ProviderUnavailable):
+            return 'unavailable'
+        elif self._is_outage_error(error):
+            return 'outage'
+        return 'error'
+
+    def _record_call(self, operation, result, duration):
+        METRICS.observe(self._provider_name, operation, result, duration)
+
     def _create_transaction(self, **kwargs):
         """Create the transaction on the backend of the service provider
         and return a json of the result of the creation"""
         raise NotImplemented
 
+    def _prepare_create_transaction(self, **kwargs):
+        """Read everything needed to create the transaction on the backend
+        of the service provider and return a function without argument
+        sending the request and returning the same result as
+        _create_transaction. The function is called in another thread by
+        GatewayTransaction.generate_multi so it must not use the ORM.
+        Return None if the provider do not support it, the transaction is
+        then created in the current thread"""
+        return None
+
+    def _get_creation_error_message(self, error):
+        """Return the message stored on the transaction when the creation
+        on the backend of the service provider failed with this error"""
+        return getattr(error, 'name', None) or str(error)
+
     def _transaction_need_3d_secure(self):
         """You can inherit this method to define if we should or not apply
         the 3d secure on the transaction. Each gateway implementation must
@@ -94,12 +283,39 @@ class PaymentService(AbstractComponent):
     def generate(self, **kwargs):
         """Generate the transaction in the provider backend
         and update the odoo gateway.transaction"""
-        transaction = self._create_transaction(**kwargs)
+        with self._call_provider('generate'):
+            transaction = self._create_transaction(**kwargs)
+        return self._write_creation_result(transaction, **kwargs)
+
+    def _write_creation_result(self, transaction, **kwargs):
         vals = self._parse_creation_result(transaction, **kwargs)
         return self.collection.write(vals)
 
     def get_state(self):
         raise NotImplemented
 
+    def get_states(self):
+        """Return the state of all the transactions of the collection
+        :return: dict {transaction id: state}"""
+        return self._fetch_states_by_page(self.collection)
+
+    def _fetch_states_by_page(self, transactions):
+        states = {}
+        size = self._state_page_size
+        for start in range(0, len(transactions), size):
+            states.update(
+                self._fetch_states(transactions[start:start + size]))
+        return states
+
+    def _fetch_states(self, transactions):
+        """Fetch the states of a page of transactions. By default the
+        provider is requested for each transaction, inherit this method
+        if the provider have a list endpoint"""
+        states = {}
+        for transaction in transactions:
+            with transaction._get_provider(self._provider_name) as provider:
+                states[transaction.id] = provider.get_state()
+        return states
+
     def capture(self, amount):
         raise NotImplemented
@@ -8,7 +8,9 @@
 # dev/tests
 
 import inspect
+import mock
 import os
+from contextlib import contextmanager
 from vcr import VCR
 from os.path import join
 import logging
@@ -66,6 +68,19 @@ class HttpComponentCase(HttpCase, ComponentMixin):
         HttpCase.setUp(self)
         self.env = api.Environment(self.registry.test_cr, 1, {})
         ComponentMixin.setUp(self)
+        self._patch_cursor('gateway.circuit.breaker', '_breaker_cursor')
+
+    def _patch_cursor(self, model, method):
+        """Use the test cursor instead of the dedicated cursor opened
+        by the method, so the writes are rolled back with the test"""
+        @contextmanager
+        def test_cursor(record):
+            yield record.env.cr
+
+        patcher = mock.patch.object(
+            type(self.env[model]), method, test_cursor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     def _init_job_counter(self):
         self.existing_job = self.env['queue.job'].search([])
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+"""
+Benchmark of an adyen authorisation with a new client for each request
+and with the pooled client, against a local http server standing in
+for adyen.
+
+Usage: python bench_client.py [number of authorisation]
+"""
+from __future__ import print_function
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+import Adyen
+from Adyen import settings
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'services'))
+from adyen_client import AdyenClientPool  # noqa
+
+RESPONSE = json.dumps({
+    'pspReference': '8535296650153317',
+    'resultCode': 'Authorised',
+    'authCode': '12345',
+    }).encode('utf-8')
+
+DATA = {
+    'username': 'ws@Company.Test',
+    'platform': 'test',
+    'merchant_account': 'TestMerchant',
+    'app_name': 'benchmark',
+    }
+
+PAYLOAD = {
+    'amount': {'value': 1500, 'currency': 'EUR'},
+    'reference': 'SO042|bench@example.com|1',
+    'merchantAccount': 'TestMerchant',
+    'additionalData': {'card.encrypted.json': 'adyenjs_0_1_18$...'},
+    }
+
+
+class AdyenStandIn(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        self.connections.add(self.client_address)
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def new_client():
+    ady = Adyen.Adyen()
+    ady.payment.client.username = DATA['username']
+    ady.payment.client.platform = DATA['platform']
+    ady.payment.client.merchant_account = DATA['merchant_account']
+    ady.payment.client.password = 'secret'
+    ady.payment.client.app_name = DATA['app_name']
+    return ady.payment
+
+
+def bench(name, get_client, number):
+    AdyenStandIn.connections.clear()
+    start = time.time()
+    for i in range(number):
+        result = get_client().authorise(request=dict(PAYLOAD))
+        assert result.message['resultCode'] == 'Authorised'
+    duration = time.time() - start
+    print('%-22s %8.3f ms/authorisation %6d connections' % (
+        name, duration / number * 1000, len(AdyenStandIn.connections)))
+
+
+def main(number):
+    server = Server(('127.0.0.1', 0), AdyenStandIn)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    settings.BASE_PAL_URL = 'http://127.0.0.1:%s/pal-{}' % server.server_port
+    pool = AdyenClientPool()
+    session = requests.Session()
+    bench('client by request', new_client, number)
+    bench('pooled client', lambda: pool.get(1, 'secret', DATA, session),
+          number)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
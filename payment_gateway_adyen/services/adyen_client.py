@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import json
+import logging
+import threading
+_logger = logging.getLogger(__name__)
+
+try:
+    import Adyen
+    from Adyen.httpclient import HTTPClient
+except ImportError:
+    _logger.debug('Cannot import Adyen')
+
+
+def bind_session(client, session):
+    """Send the requests of the adyen client with the requests session
+    so the connections are kept alive between the requests"""
+    http_client = HTTPClient(
+        client.app_name,
+        client.USER_AGENT_SUFFIX,
+        client.LIB_VERSION,
+        client.http_force)
+
+    # same signature and result as HTTPClient._requests_post
+    def request(url, json=None, data=None, username="", password="",
+                xapikey="", headers=None, timeout=None):
+        headers = dict(headers or {})
+        auth = None
+        if username and password:
+            auth = (username, password)
+        elif xapikey:
+            headers['x-api-key'] = xapikey
+        headers['User-Agent'] = http_client.user_agent
+        response = session.post(
+            url, auth=auth, data=data, json=json, headers=headers,
+            timeout=timeout)
+        return response.text, json, response.status_code, response.headers
+
+    http_client.request = request
+    client.http_client = http_client
+    client.http_init = True
+
+
+class AdyenClientPool(object):
+    """Adyen clients by keychain account, they are reused between the
+    requests and rebuilt when the credentials of the account or the http
+    session change"""
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _build(self, password, data, session):
+        ady = Adyen.Adyen()
+        ady.payment.client.username = data['username']
+        ady.payment.client.platform = str(data['platform'])
+        ady.payment.client.merchant_account = data['merchant_account']
+        ady.payment.client.password = password
+        ady.payment.client.app_name = data['app_name']
+        bind_session(ady.payment.client, session)
+        return ady.payment
+
+    def get(self, account_id, password, data, session):
+        signature = (password, json.dumps(data, sort_keys=True), id(session))
+        with self._lock:
+            client, client_signature = self._clients.get(
+                account_id, (None, None))
+            if client is None or client_signature != signature:
+                client = self._build(password, data, session)
+                self._clients[account_id] = (client, signature)
+        return client
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
@@ -7,6 +7,13 @@ from odoo.exceptions import Warning as UserError
 from odoo.tools.translate import _
 from odoo.tools.float_utils import float_round
 from odoo.addons.component.core import Component
+from odoo.addons.payment_gateway.exceptions import ProviderConnectionError
+from odoo.tools import consteq
+from .adyen_client import AdyenClientPool
+import base64
+import binascii
+import hashlib
+import hmac
 import re
 import json
 import logging
@@ -14,7 +21,6 @@ _logger = logging.getLogger(__name__)
 
 
 try:
-    import Adyen
     from Adyen.exceptions import (AdyenAPIValidationError,
                                   AdyenAPIResponseError,
                                   AdyenAPIAuthenticationError,
@@ -45,14 +51,59 @@ THREE_DECIMAL_CURRENCIES = [
     u'BHD', u'JOD', u'KWD', u'LYD', u'OMR', u'TND'
 ]
 
+# state of the transaction by event code and success of the notification
+MAP_NOTIFICATION_STATE = {
+    ('AUTHORISATION', 'true'): 'to_capture',
+    ('AUTHORISATION', 'false'): 'failed',
+    ('CAPTURE', 'true'): 'succeeded',
+    ('CAPTURE_FAILED', 'true'): 'failed',
+    ('CANCELLATION', 'true'): 'cancel',
+    ('CANCEL_OR_REFUND', 'true'): 'cancel',
+    }
+
+# the notifications only update the transactions waiting for adyen
+NOTIFICATION_UPDATABLE_STATES = ['pending', 'to_capture']
+
+# stage of the states, the notifications of a batch are not ordered and a
+# state never replaces the state of a later stage
+NOTIFICATION_STATE_RANK = {
+    'pending': 0,
+    'to_capture': 1,
+    'succeeded': 2,
+    'failed': 2,
+    'cancel': 2,
+    }
+
+# fields of the notification signed by the hmac signature
+NOTIFICATION_SIGNED_FIELDS = [
+    'pspReference', 'originalReference', 'merchantAccountCode',
+    'merchantReference', 'amount.value', 'amount.currency', 'eventCode',
+    'success']
+
+
+# adyen clients shared by the workers threads
+ADYEN_CLIENTS = AdyenClientPool()
+
 
 class PaymentService(Component):
     _inherit = 'payment.service'
     _name = 'payment.service.adyen'
     _usage = 'gateway.provider'
     _allowed_capture_method = ['immediately']
+    _webhook_method = ['process_notification']
+    # adyen expect the raw '[accepted]' answer
+    _webhook_raw_response = True
 
     def _raise_error_message(self, code):
+        if code == 'communication_error':
+            raise ProviderConnectionError(self._get_error_message(code))
+        raise UserError(self._get_error_message(code))
+
+    def _is_outage_error(self, error):
+        return isinstance(error, AdyenAPICommunicationError) or super(
+            PaymentService, self)._is_outage_error(error)
+
+    def _get_error_message(self, code):
         errors = {
             # admin errors (can be detailed):
             'authentication_failed':
@@ -85,9 +136,33 @@ class PaymentService(Component):
                      " the right length"),
             '153': _("The card's security code is invalid.")
             }
-        raise UserError(errors.get(code, ("Transaction failed. "
-                                          "Some unknown error happened"
-                                          "with the Adyen payment gateway.")))
+        return errors.get(code, ("Transaction failed. "
+                                 "Some unknown error happened"
+                                 "with the Adyen payment gateway."))
+
+    def _get_error_code(self, error):
+        if isinstance(error, AdyenAPIAuthenticationError):
+            return 'authentication_failed'
+        elif isinstance(error, AdyenAPIInvalidPermission):
+            return 'invalid_permission'
+        elif isinstance(error, AdyenAPICommunicationError):
+            return 'communication_error'
+        elif isinstance(error, AdyenAPIInvalidAmount):
+            return 'invalid_amount'
+        elif isinstance(error, AdyenAPIInvalidFormat):
+            return 'validation'
+        elif isinstance(error, (AdyenAPIResponseError,
+                                AdyenAPIValidationError)):
+            if error.error_code:
+                return error.error_code
+            match = re.search('errorCode: ([0-9][0-9][0-9][0-9]?)',
+                              error.message)
+            if match:
+                return match.group(1).strip()
+            return 'undef'
+        else:
+            _logger.info('Adyen Error %s' % error)
+            return 'undef'
 
     def _http_adyen_request(self, service, payload):
         "re-catches Adyen errors to be more user friendly"
@@ -95,30 +170,14 @@ class PaymentService(Component):
             raise UserError(_('Invalid API service!'))
         try:
             return getattr(self._get_adyen_client(), service)(request=payload)
-        except AdyenAPIAuthenticationError as e:
-            self._raise_error_message('authentication_failed')
-        except AdyenAPIInvalidPermission as e:
-            self._raise_error_message('invalid_permission')
-        except AdyenAPICommunicationError as e:
-            self._raise_error_message('communication_error')
-        except AdyenAPIInvalidAmount as e:
-            self._raise_error_message('invalid_amount')
-        except AdyenAPIInvalidFormat as e:
-            self._raise_error_message('validation')
-        except (AdyenAPIResponseError, AdyenAPIValidationError) as e:
-            if e.error_code:
-                code = e.error_code
-            else:
-                match = re.search('errorCode: ([0-9][0-9][0-9][0-9]?)',
-                                  e.message)
-                if match:
-                    code = match.group(1).strip()
-                else:
-                    code = 'undef'
-            self._raise_error_message(code)
         except Exception as e:
-            _logger.info('Adyen Error %s' % e)
-            self._raise_error_message('undef')
+            self._raise_error_message(self._get_error_code(e))
+
+    def _get_creation_error_message(self, error):
+        if isinstance(error, UserError):
+            return super(PaymentService, self)._get_creation_error_message(
+                error)
+        return self._get_error_message(self._get_error_code(error))
 
     def process_return(self, browser_info=None, md=None, pares=None,
                        shopper_ip=None, **params):
@@ -134,7 +193,7 @@ class PaymentService(Component):
             }
         transaction = self.env['gateway.transaction'].search([
             ('external_id', '=', result.message['pspReference']),
-            ('payment_mode_id.provider', '=', 'adyen'),
+            ('provider', '=', 'adyen'),
             ])
         if transaction:
             transaction.write(vals)
@@ -144,6 +203,143 @@ class PaymentService(Component):
                 _('The transaction %s do not exist in Odoo') % result.message[
                     'pspReference'])
 
+    # Code for the notifications sent by adyen
+
+    def _get_notification_signature(self, item, hmac_key):
+        values = []
+        for field in NOTIFICATION_SIGNED_FIELDS:
+            value = item
+            for key in field.split('.'):
+                value = (value or {}).get(key)
+            values.append(u'%s' % (value if value is not None else ''))
+        digest = hmac.new(
+            binascii.a2b_hex(hmac_key),
+            u':'.join(values).encode('utf-8'),
+            hashlib.sha256).digest()
+        return base64.b64encode(digest)
+
+    def _check_notification_signature(self, item, hmac_key):
+        signature = (item.get('additionalData') or {}).get(
+            'hmacSignature') or u''
+        return consteq(
+            self._get_notification_signature(item, hmac_key),
+            signature.encode('utf-8'))
+
+    def _verify_webhook(self, method_name, payload, headers):
+        """The batch is verified when all its notifications are signed
+        with the hmac key of the account"""
+        if method_name != 'process_notification':
+            return super(PaymentService, self)._verify_webhook(
+                method_name, payload, headers)
+        hmac_key = self._get_credentials()['data'].get('hmac_key')
+        if not hmac_key:
+            _logger.warning(
+                'Adyen notifications not verified, the hmac_key of the '
+                'account is missing')
+            return False
+        try:
+            items = [item['NotificationRequestItem']
+                     for item in json.loads(payload)['notificationItems']]
+            for item in items:
+                if not self._check_notification_signature(item, hmac_key):
+                    _logger.warning(
+                        'Invalid signature of adyen notification %s',
+                        item.get('pspReference'))
+                    return False
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return False
+        return bool(items)
+
+    def process_notification(self, **params):
+        # adyen can not be asked the state of the transactions, the
+        # content of the notifications is only applied if signed
+        _logger.warning('Unsigned adyen notifications ignored')
+        return False
+
+    def process_notification_verified(self, notificationItems=None,
+                                      **params):
+        """Apply the state of the notifications of the batch, the
+        transactions are read with one search and written by state"""
+        updates = []
+        for item in notificationItems or []:
+            item = item.get('NotificationRequestItem') or {}
+            state = MAP_NOTIFICATION_STATE.get(
+                (item.get('eventCode'), item.get('success')))
+            if state:
+                updates.append((
+                    item.get('pspReference'),
+                    item.get('originalReference'),
+                    state))
+        references = set(
+            reference for update in updates for reference in update[:2]
+            if reference)
+        if not references:
+            return True
+        transactions = self.env['gateway.transaction'].search([
+            ('external_id', 'in', list(references)),
+            ('provider', '=', 'adyen'),
+            ('state', 'in', NOTIFICATION_UPDATABLE_STATES),
+            ])
+        # the modifications have their own psp reference, the one of the
+        # payment is the original reference
+        ids = {transaction.external_id: transaction.id
+               for transaction in transactions}
+        states = {transaction.id: transaction.state
+                  for transaction in transactions}
+        for psp_reference, original_reference, state in updates:
+            transaction_id = ids.get(psp_reference) or ids.get(
+                original_reference)
+            if transaction_id and NOTIFICATION_STATE_RANK[state] > \
+                    NOTIFICATION_STATE_RANK[states[transaction_id]]:
+                states[transaction_id] = state
+        transactions._write_states(states)
+        return True
+
+    def _get_webhook_response(self, method_name):
+        # adyen expect this answer or the notifications are sent again
+        return '[accepted]'
+
+    def _validator_process_notification(self):
+        return self._validator_process_notification_verified()
+
+    def _validator_process_notification_verified(self):
+        item = {
+            'pspReference': {'type': 'string'},
+            'originalReference': {'type': 'string', 'nullable': True},
+            'merchantAccountCode': {'type': 'string'},
+            'merchantReference': {'type': 'string', 'nullable': True},
+            'amount': {
+                'type': 'dict',
+                'schema': {
+                    'value': {'type': 'integer'},
+                    'currency': {'type': 'string'},
+                }
+            },
+            'eventCode': {'type': 'string'},
+            'success': {'type': 'string'},
+            'additionalData': {
+                'type': 'dict',
+                'nullable': True,
+                'schema': {
+                    'hmacSignature': {'type': 'string'},
+                }
+            },
+        }
+        return {
+            'notificationItems': {
+                'type': 'list',
+                'schema': {
+                    'type': 'dict',
+                    'schema': {
+                        'NotificationRequestItem': {
+                            'type': 'dict',
+                            'schema': item,
+                        }
+                    }
+                }
+            }
+        }
+
     def _get_formatted_amount(self, amount=None):
         if amount is None:
             amount = self.collection._get_amount_to_capture()
@@ -207,20 +403,13 @@ class PaymentService(Component):
         return vals
 
     def _use_3ds(self):
-        account = self._get_account()
-        data = account.get_data()
-        return data.get('dynamic_3ds')
+        return self._get_credentials()['data'].get('dynamic_3ds')
 
     def _get_adyen_client(self):
-        account = self._get_account()
-        data = account.get_data()
-        ady = Adyen.Adyen()
-        ady.payment.client.username = data['username']
-        ady.payment.client.platform = str(data['platform'])
-        ady.payment.client.merchant_account = data['merchant_account']
-        ady.payment.client.password = account._get_password()
-        ady.payment.client.app_name = data['app_name']
-        return ady.payment
+        credentials = self._get_credentials()
+        return ADYEN_CLIENTS.get(
+            credentials['id'], credentials['password'], credentials['data'],
+            self._get_http_session())
 
     def _create_transaction(
             self, token=None, browser_info=None, **kwargs):
@@ -230,6 +419,15 @@ class PaymentService(Component):
             **kwargs)
         return self._http_adyen_request('authorise', payload)
 
+    def _prepare_create_transaction(
+            self, token=None, browser_info=None, **kwargs):
+        payload = self._prepare_charge(
+            token=token,
+            browser_info=browser_info,
+            **kwargs)
+        client = self._get_adyen_client()
+        return lambda: client.authorise(request=payload)
+
     def _parse_creation_result(self, transaction, **kwargs):
         transaction = transaction.message
         res = {
@@ -249,6 +447,11 @@ class PaymentService(Component):
                 })
         return res
 
+    def get_state(self):
+        # Adyen do not provide an api to read the state of a payment,
+        # the state is only updated by the return of the customer
+        return self.collection.state
+
     # Code for capturing the transaction
 
     def _parse_capture_result(self, charge):
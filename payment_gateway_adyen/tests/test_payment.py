@@ -18,7 +18,8 @@ from adyen_cse_python.encrypter import ClientSideEncrypter
 from odoo.exceptions import UserError
 from odoo.addons.payment_gateway.tests.common import (
     PaymentScenarioType,
-    HttpComponentCase)
+    HttpComponentCase,
+    JSON_WEBHOOK_PATH)
 
 
 FAKE_KEY = (
@@ -32,6 +33,8 @@ FAKE_KEY = (
     "DBEC9B8E52FE1E0221EC5"
 )
 
+HMAC_KEY = '44782DEF547AAA06C910C43932B1EB0C71FC68D9D0C057550C48EC2ACF6BA056'
+
 SHOPPER_IP = '42.42.42.42'
 ACCEPT_HEADER =\
     'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'
@@ -223,3 +226,67 @@ class AdyenCase(AdyenCommonCase, AdyenScenario):
     def _test_card(self, card, **kwargs):
         transaction, source = self._create_transaction(card)
         self._check_captured(transaction, **kwargs)
+
+    def _get_notification_item(self, transaction, event_code, success):
+        item = {
+            'merchantAccountCode': 'offline',
+            'merchantReference': transaction.name,
+            'amount': {'value': 294750, 'currency': 'USD'},
+            'eventCode': event_code,
+            'success': success,
+            }
+        if event_code == 'AUTHORISATION':
+            item['pspReference'] = transaction.external_id
+        else:
+            # a modification have its own psp reference
+            item.update({
+                'pspReference': '8815294125319999',
+                'originalReference': transaction.external_id,
+                })
+        with transaction._get_provider('adyen') as provider:
+            signature = provider._get_notification_signature(item, HMAC_KEY)
+        item['additionalData'] = {'hmacSignature': signature}
+        return {'NotificationRequestItem': item}
+
+    def _post_notification(self, items):
+        base_url = self.env['ir.config_parameter'].get_param('web.base.url')
+        return requests.post(
+            base_url + JSON_WEBHOOK_PATH + '/adyen/process_notification',
+            json={'live': 'false', 'notificationItems': items})
+
+    def test_process_notification(self):
+        account = self.env['keychain.account'].search(
+            [('namespace', '=', 'adyen')])
+        account.write({'data': json.dumps(
+            dict(account.get_data(), hmac_key=HMAC_KEY))})
+        transaction_obj = self.env['gateway.transaction']
+        vals = transaction_obj._prepare_transaction(self.sale)
+        refused, cancelled, captured, wrong_signature = [
+            transaction_obj.create(dict(
+                vals, state='pending', external_id='881529412531193%s' % i))
+            for i in range(4)]
+        self._init_job_counter()
+        # the capture is notified before the authorisation in the batch
+        response = self._post_notification([
+            self._get_notification_item(refused, 'AUTHORISATION', 'false'),
+            self._get_notification_item(cancelled, 'CANCELLATION', 'true'),
+            self._get_notification_item(captured, 'CAPTURE', 'true'),
+            self._get_notification_item(captured, 'AUTHORISATION', 'true'),
+            ])
+        self.assertEqual(response.text, '[accepted]')
+        self._check_nbr_job_created(1)
+        self._perform_created_job()
+        self.assertEqual(refused.state, 'failed')
+        self.assertEqual(cancelled.state, 'cancel')
+        self.assertEqual(captured.state, 'succeeded')
+
+        # a batch with a wrong signature is ignored
+        tampered = self._get_notification_item(
+            wrong_signature, 'CANCELLATION', 'false')
+        tampered['NotificationRequestItem']['success'] = 'true'
+        self._init_job_counter()
+        response = self._post_notification([tampered])
+        self.assertEqual(response.text, '[accepted]')
+        self._check_nbr_job_created(1)
+        self._perform_created_job()
+        self.assertEqual(wrong_signature.state, 'pending')
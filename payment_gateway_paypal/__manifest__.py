@@ -22,6 +22,8 @@
     ],
     "data": [
         "data/payment_method_data.xml",
+        "views/account_payment_mode_view.xml",
+        "security/ir.model.access.csv",
     ],
     "demo": [
     ],
@@ -4,3 +4,5 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
 from . import keychain
+from . import paypal_access_token
+from . import account_payment_mode
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo import fields, models
+
+
+class AccountPaymentMode(models.Model):
+    _inherit = 'account.payment.mode'
+
+    paypal_flow = fields.Selection([
+        ('payment', 'Payments (v1)'),
+        ('order', 'Orders (v2)'),
+        ], default='payment',
+        help="With Orders the payment is captured in one request when "
+             "the customer come back from paypal")
+    paypal_deferred_capture = fields.Boolean(
+        help="Capture the payment in a job when the customer come back "
+             "from paypal, so the customer is redirected immediately")
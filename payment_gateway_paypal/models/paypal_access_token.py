@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from odoo import api, fields, models
+
+
+class PaypalAccessToken(models.Model):
+    """
+    OAuth access token of the paypal accounts, they are stored in database
+    so all the workers share the same token
+    """
+    _name = 'paypal.access.token'
+    _description = 'Paypal Access Token'
+    _log_access = False
+    # the token is refreshed this number of seconds before its expiry
+    _refresh_margin = 300
+
+    account_id = fields.Many2one(
+        'keychain.account',
+        'Account',
+        required=True,
+        ondelete='cascade')
+    access_token = fields.Char(required=True)
+    token_type = fields.Char(required=True)
+    expires_at = fields.Datetime(required=True)
+
+    _sql_constraints = [
+        ('account_uniq', 'unique(account_id)',
+         'An account can only have one token'),
+    ]
+
+    @api.model
+    def _get_token_hash(self, account_id):
+        """
+        :return: the token hash of the account (same format as the one
+        returned by paypal) or None if there is no valid token
+        """
+        now = datetime.now()
+        self._cr.execute("""
+            SELECT access_token, token_type, expires_at
+            FROM paypal_access_token
+            WHERE account_id = %s AND expires_at > %s
+            """, (account_id, fields.Datetime.to_string(
+                now + timedelta(seconds=self._refresh_margin))))
+        row = self._cr.fetchone()
+        if not row:
+            return None
+        expires_at = fields.Datetime.from_string(row[2])
+        return {
+            'access_token': row[0],
+            'token_type': row[1],
+            'expires_in': int((expires_at - now).total_seconds()),
+            }
+
+    @contextmanager
+    def _token_cursor(self):
+        """The token is committed in its own transaction, so the other
+        workers can use it even if the current transaction is rolled back.
+        The tests patch this method to keep using the test cursor"""
+        with self.env.registry.cursor() as cr:
+            yield cr
+
+    @api.model
+    def _store_token_hash(self, account_id, token_hash):
+        expires_at = datetime.now() + timedelta(
+            seconds=token_hash['expires_in'])
+        with self._token_cursor() as cr:
+            cr.execute("""
+                INSERT INTO paypal_access_token
+                    (account_id, access_token, token_type, expires_at)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (account_id) DO UPDATE SET
+                    access_token = EXCLUDED.access_token,
+                    token_type = EXCLUDED.token_type,
+                    expires_at = EXCLUDED.expires_at
+                """, (account_id,
+                      token_hash['access_token'],
+                      token_hash['token_type'],
+                      fields.Datetime.to_string(expires_at)))
@@ -8,6 +8,7 @@ from odoo.exceptions import Warning as UserError
 from odoo.tools import float_round, float_repr
 from odoo.addons.component.core import Component
 
+from datetime import datetime
 import json
 import logging
 _logger = logging.getLogger(__name__)
@@ -18,18 +19,75 @@ except ImportError:
     _logger.debug('Can not `import paypalrestsdk` library')
 
 
+MAP_PAYMENT_STATE = {
+    'created': 'pending',
+    'approved': 'succeeded',
+    'failed': 'failed',
+    'canceled': 'cancel',
+    'expired': 'abandoned',
+    }
+
+MAP_ORDER_STATE = {
+    'CREATED': 'pending',
+    'SAVED': 'pending',
+    'PAYER_ACTION_REQUIRED': 'pending',
+    'APPROVED': 'to_capture',
+    'VOIDED': 'cancel',
+    'COMPLETED': 'succeeded',
+    }
+
+ORDER_PATH = 'v2/checkout/orders'
+# ask the full order in the responses, the amount is not returned otherwise
+ORDER_HEADERS = {'Prefer': 'return=representation'}
+
+
 class PaymentService(Component):
     _inherit = 'payment.service'
     _name = 'payment.service.paypal'
     _usage = 'gateway.provider'
     _allowed_capture_method = ['immediately']
+    # paypal payments not approved are expired after 3 hours
+    _pending_timeout = 3
 
     def _get_connection(self):
-        account = self._get_account()
-        params = account.get_data()
+        credentials = self._get_credentials()
+        params = credentials['data']
         experience_profile = params.pop("experience_profile_id", None)
-        params['client_secret'] = account._get_password()
-        return paypalrestsdk.Api(params), experience_profile
+        params['client_secret'] = credentials['password']
+        api = paypalrestsdk.Api(params)
+        self._bind_session(api)
+        self._set_token(api, credentials['id'])
+        return api, experience_profile
+
+    def _bind_session(self, api):
+        """Send the requests of the api with the pooled http session
+        instead of opening a new connection for each request"""
+        session = self._get_http_session()
+
+        # same signature and result as Api.http_call
+        def http_call(url, method, **kwargs):
+            response = session.request(
+                method, url, proxies=api.proxies, **kwargs)
+            return api.handle_response(
+                response, response.content.decode('utf-8'))
+
+        api.http_call = http_call
+
+    def _is_outage_error(self, error):
+        return isinstance(error, paypalrestsdk.exceptions.ServerError) or\
+            super(PaymentService, self)._is_outage_error(error)
+
+    def _set_token(self, api, account_id):
+        """Set the access token shared by all the workers on the api,
+        a new token is only requested when it's about to expire"""
+        token_obj = self.env['paypal.access.token']
+        token_hash = token_obj._get_token_hash(account_id)
+        if token_hash is None:
+            token_hash = api.get_token_hash()
+            token_obj._store_token_hash(account_id, token_hash)
+        else:
+            api.token_hash = token_hash
+            api.token_request_at = datetime.now()
 
     def _get_formatted_amount(self, amount):
         """paypal API is expecting at most two (2) decimal places with a
@@ -62,18 +120,70 @@ class PaymentService(Component):
                 }],
             }
 
+    def _get_flow(self):
+        return self.collection.payment_mode_id.paypal_flow or 'payment'
+
+    def _prepare_order(self, return_url, **kwargs):
+        transaction = self.collection
+        description = "|".join([
+            transaction.name,
+            transaction.partner_id.email,
+            ('%s' % transaction.id)])
+        amount = self._get_formatted_amount(
+            transaction._get_amount_to_capture())
+        return {
+            "intent": "CAPTURE",
+            "purchase_units": [{
+                "amount": {
+                    "value": amount,
+                    "currency_code": transaction.currency_id.name,
+                    },
+                "description": description,
+                }],
+            "application_context": {
+                "return_url": return_url,
+                "cancel_url": transaction.redirect_cancel_url,
+                "user_action": "PAY_NOW",
+                },
+            }
+
     def _create_transaction(self, **kwargs):
+        return self._prepare_create_transaction(**kwargs)()
+
+    def _prepare_create_transaction(self, **kwargs):
+        if self._get_flow() == 'order':
+            data = self._prepare_order(**kwargs)
+            paypal, experience_profile = self._get_connection()
+            return lambda: paypal.post(
+                ORDER_PATH, data, headers=dict(ORDER_HEADERS))
         data = self._prepare_transaction(**kwargs)
         # TODO paypal lib is not perfect, we should wrap it in a class
         paypal, experience_profile = self._get_connection()
         data["experience_profile_id"] = experience_profile
-        payment = paypalrestsdk.Payment(data, api=paypal)
-        if not payment.create():
-            # TODO improve manage error
-            raise UserError(payment.error)
-        return payment.to_dict()
+
+        def create():
+            payment = paypalrestsdk.Payment(data, api=paypal)
+            if not payment.create():
+                # TODO improve manage error
+                raise UserError(payment.error)
+            return payment.to_dict()
+
+        return create
+
+    def _parse_order(self, order):
+        url = [l for l in order['links'] if l['rel'] == 'approve'][0]
+        return {
+            'amount': order['purchase_units'][0]['amount']['value'],
+            'external_id': order['id'],
+            'data': json.dumps(order),
+            'url': url['href'],
+            'state': MAP_ORDER_STATE[order['status']],
+            'meta': {'paypal_flow': 'order'},
+        }
 
     def _parse_creation_result(self, transaction, **kwargs):
+        if 'purchase_units' in transaction:
+            return self._parse_order(transaction)
         url = [l for l in transaction['links'] if l['method'] == 'REDIRECT'][0]
         return {
             'amount': transaction['transactions'][0]['amount']['total'],
@@ -85,25 +195,97 @@ class PaymentService(Component):
 
     def process_return(self, **params):
         # For now we always capture immediatly the paypal transaction
+        # paypal add the paymentId (payments) or the token (orders) and
+        # the PayerID to the return url
+        external_id = params.get('paymentId') or params.get('token')
         transaction = self.env['gateway.transaction'].search([
-            ('external_id', '=', params['paymentId']),
-            ('payment_mode_id.provider', '=', 'paypal'),
+            ('external_id', '=', external_id),
+            ('provider', '=', 'paypal'),
             ('state', '=', 'pending')])
         if transaction:
-            transaction.capture()
+            if params.get('PayerID'):
+                transaction.write({'meta': dict(
+                    transaction.meta or {},
+                    paypal_payer_id=params['PayerID'])})
+            if transaction.payment_mode_id.paypal_deferred_capture:
+                transaction.with_delay(
+                    channel=transaction._get_job_channel('capture', 'paypal'),
+                    ).capture()
+            else:
+                transaction.capture()
             return transaction
         else:
             raise UserError(
                 _('The transaction %s do not exist in Odoo')
-                % params['paymentId'])
+                % external_id)
+
+    def _is_order(self):
+        return (self.collection.meta or {}).get('paypal_flow') == 'order'
+
+    def get_state(self):
+        """Return the state of the transaction or None if the state of
+        paypal is unknown, the transaction is then left unchanged"""
+        paypal, experience_profile = self._get_connection()
+        if self._is_order():
+            order = paypal.get(
+                '%s/%s' % (ORDER_PATH, self.collection.external_id))
+            status = order['status']
+            state = MAP_ORDER_STATE.get(status)
+        else:
+            payment = paypalrestsdk.Payment.find(
+                self.collection.external_id, api=paypal)
+            status = payment.to_dict()['state']
+            state = MAP_PAYMENT_STATE.get(status)
+        if not state:
+            _logger.warning(
+                'Unknown paypal state %s of transaction %s',
+                status, self.collection.external_id)
+        return state
+
+    def _capture_order(self, paypal):
+        transaction = self.collection
+        try:
+            order = paypal.post(
+                '%s/%s/capture' % (ORDER_PATH, transaction.external_id), {},
+                headers=dict(ORDER_HEADERS))
+        except paypalrestsdk.exceptions.ClientError as e:
+            # the capture is refused (ResourceInvalid when the payer
+            # have not approved the order)
+            transaction.write({
+                'state': 'failed',
+                'error': str(e),
+                })
+            return
+        if MAP_ORDER_STATE.get(order['status']) == 'succeeded':
+            vals = {
+                'state': 'succeeded',
+                'data': json.dumps(order),
+                }
+        else:
+            vals = {
+                'state': 'failed',
+                'error': _('Wrong state in result'),
+                'data': json.dumps(order),
+                }
+        transaction.write(vals)
 
     def capture(self):
         transaction = self.collection
         paypal, experience_profile = self._get_connection()
-        payment = paypalrestsdk.Payment.find(
-            transaction.external_id, api=paypal)
-        payer_id = payment.to_dict()['payer']\
-            .get('payer_info', {}).get('payer_id')
+        if self._is_order():
+            # the order is captured in one request
+            return self._capture_order(paypal)
+        payer_id = (transaction.meta or {}).get('paypal_payer_id')
+        if payer_id:
+            # the payer is given by the return of the customer, the
+            # payment do not need to be read
+            payment = paypalrestsdk.Payment(
+                {'id': transaction.external_id}, api=paypal)
+        else:
+            payment = paypalrestsdk.Payment.find(
+                transaction.external_id, api=paypal)
+            payer_id = payment.to_dict()['payer']\
+                .get('payer_info', {}).get('payer_id')
         if payer_id:
             if payment.execute({'payer_id': payer_id}):
                 result = payment.to_dict()
@@ -111,13 +293,13 @@ class PaymentService(Component):
                 if result['state'] == 'approved':
                     vals = {
                         'state': 'succeeded',
-                        'data': result,
+                        'data': json.dumps(result),
                         }
                 else:
                     vals = {
                         'state': 'failed',
                         'error': _('Wrong state in result'),
-                        'data': result,
+                        'data': json.dumps(result),
                         }
             else:
                 vals = {
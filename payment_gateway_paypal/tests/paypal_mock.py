@@ -15,6 +15,54 @@ REDIRECT_URL = {
     'return_url': 'https://ThanksYou.com',
     }
 
+TOKEN_HASH = {
+    'scope': 'https://uri.paypal.com/services/payments/payment',
+    'access_token': 'A21AAHZdmVY0gq6NKY5ai3frxg7bQbwXjaUD',
+    'token_type': 'Bearer',
+    'app_id': 'APP-80W284485P519543T',
+    'expires_in': 32400,
+    }
+
+PAYPAL_ORDER = {
+    'id': u'5O190127TN364715T',
+    'intent': u'CAPTURE',
+    'status': u'CREATED',
+    'purchase_units': [{
+        'amount': {'currency_code': u'USD', 'value': u'2947.50'},
+        }],
+    'links': [{
+        'href': u'https://api.paypal.com/v2/checkout/orders/5O190127TN364715T',
+        'method': u'GET',
+        'rel': u'self',
+    }, {
+        'href': u'https://www.paypal.com/checkoutnow?token=5O190127TN364715T',
+        'method': u'GET',
+        'rel': u'approve',
+    }, {
+        'href': u'https://api.paypal.com/v2/checkout/orders/'
+                u'5O190127TN364715T/capture',
+        'method': u'POST',
+        'rel': u'capture',
+    }],
+    }
+
+
+def paypal_order_post(action, params=None, headers=None):
+    """Answer the requests of the orders api"""
+    order = copy.deepcopy(PAYPAL_ORDER)
+    if action.endswith('/capture'):
+        order['status'] = u'COMPLETED'
+    return order
+
+
+def paypal_order_post_refused(action, params=None, headers=None):
+    """Refuse the capture of the order"""
+    if action.endswith('/capture'):
+        raise paypalrestsdk.exceptions.ResourceInvalid(
+            Mock(status_code=422, reason='Unprocessable Entity'),
+            content='{"name": "UNPROCESSABLE_ENTITY"}')
+    return paypal_order_post(action, params=params, headers=headers)
+
 
 class PaypalPaymentSuccess(Mock):
 
@@ -88,8 +136,18 @@ class PaypalPaymentWrongState(PaypalPaymentSuccess):
         return True
 
 
+class PaypalPaymentServerError(PaypalPaymentSuccess):
+
+    # pylint: disable=W8106
+    def create(self):
+        raise paypalrestsdk.exceptions.ServerError(
+            Mock(status_code=503, reason='Service Unavailable'))
+
+
 @contextmanager
 def paypal_mock(payment_class):
-    paypalrestsdk.Api = Mock(return_value='123')
+    api = Mock()
+    api.get_token_hash.return_value = dict(TOKEN_HASH)
+    paypalrestsdk.Api = Mock(return_value=api)
     paypalrestsdk.Payment = payment_class()
     yield True
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import mock
+from .test_payment import PaypalCommonCase
+
+
+class PaypalBatchCase(PaypalCommonCase):
+
+    def _create_transactions(self, count, state, mode=None):
+        transaction_obj = self.env['gateway.transaction']
+        vals = transaction_obj._prepare_transaction(self.sale)
+        vals.update({
+            'state': state,
+            'payment_mode_id': (mode or self.account_payment_mode).id,
+            })
+        transactions = transaction_obj.browse()
+        for i in range(count):
+            transactions |= transaction_obj.create(vals)
+        return transactions
+
+    def test_capture_batch(self):
+        transactions = self._create_transactions(5, 'to_capture')
+        self._init_job_counter()
+        jobs = transactions.capture_batch(chunk_size=2)
+        self.assertEqual(len(jobs), 3)
+        self._check_nbr_job_created(3)
+        self.assertEqual(
+            set(self.created_jobs.mapped('method_name')),
+            set(['capture_chunk']))
+        self.assertEqual(
+            sorted(len(job.record_ids) for job in self.created_jobs),
+            [1, 2, 2])
+
+    def test_capture_chunk(self):
+        transactions = self._create_transactions(3, 'to_capture')
+        failing = transactions[1]
+
+        def capture(record):
+            if record == failing:
+                record.write({'error': 'partially captured'})
+                raise ValueError('Capture failed')
+            record.write({'state': 'succeeded'})
+
+        with mock.patch.object(type(transactions), 'capture', capture):
+            result = transactions.capture_chunk()
+        # the failure is rolled back without the other captures
+        self.assertEqual(result, {
+            transactions[0].id: {'state': 'succeeded', 'error': False},
+            failing.id: {'state': 'to_capture', 'error': 'Capture failed'},
+            transactions[2].id: {'state': 'succeeded', 'error': False},
+            })
+        self.assertFalse(failing.error)
+        self.assertEqual(failing.state, 'to_capture')
+
+    def test_check_state(self):
+        other_account = self.env['keychain.account'].create({
+            'namespace': 'paypal',
+            'name': 'Other Paypal',
+            'clear_password': 'test',
+            'technical_name': 'other_paypal',
+            'data': """{
+                "client_id": "ycezvezv3448cdyvuvkrzoz98765gcxzgc",
+                "experience_profile_id": "LX-39DK-DI4IH-EOD3-KDO0"
+            }""",
+            })
+        other_mode = self.account_payment_mode.copy(
+            {'provider_account': other_account.id})
+        transactions = self._create_transactions(2, 'pending') |\
+            self._create_transactions(3, 'pending', mode=other_mode)
+        new_states = dict(zip(transactions.ids, [
+            'succeeded', 'succeeded', 'failed', 'succeeded', 'pending']))
+        collections = []
+
+        def get_states(provider):
+            collections.append(provider.collection)
+            return {transaction.id: new_states[transaction.id]
+                    for transaction in provider.collection}
+
+        writes = []
+        write = type(transactions).write
+
+        def record_write(records, vals):
+            if 'state' in vals:
+                writes.append((vals['state'], sorted(records.ids)))
+            return write(records, vals)
+
+        with transactions._get_provider('paypal') as provider:
+            provider_class = type(provider)
+        with mock.patch.object(provider_class, 'get_states', get_states), \
+                mock.patch.object(type(transactions), 'write', record_write):
+            transactions.check_state()
+        # the states are fetched once by account and written once by state
+        self.assertEqual(
+            sorted(collection.ids for collection in collections),
+            [transactions[:2].ids, transactions[2:].ids])
+        self.assertEqual(sorted(writes), [
+            ('failed', [transactions[2].id]),
+            ('succeeded', transactions[:2].ids),
+            ('succeeded', [transactions[3].id]),
+            ])
+        self.assertEqual(
+            transactions.mapped('state'),
+            ['succeeded', 'succeeded', 'failed', 'succeeded', 'pending'])
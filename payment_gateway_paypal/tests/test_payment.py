@@ -7,10 +7,20 @@ from .paypal_mock import (
     paypal_mock,
     PaypalPaymentSuccess,
     PaypalPaymentNoPayer,
+    PaypalPaymentServerError,
     PaypalPaymentWrongState,
-    REDIRECT_URL)
+    PAYPAL_ORDER,
+    REDIRECT_URL,
+    TOKEN_HASH,
+    paypal_order_post,
+    paypal_order_post_refused)
 from odoo.addons.payment_gateway.tests.common import HttpComponentCase
 import paypalrestsdk
+import shutil
+import tempfile
+from odoo.addons.payment_gateway.exceptions import ProviderUnavailable
+from odoo.addons.payment_gateway.metrics import METRICS, Metrics
+from odoo import fields
 from odoo.exceptions import UserError
 
 
@@ -18,6 +28,7 @@ class PaypalCommonCase(HttpComponentCase):
 
     def setUp(self, *args, **kwargs):
         super(PaypalCommonCase, self).setUp(*args, **kwargs)
+        self._patch_cursor('paypal.access.token', '_token_cursor')
         self.env['keychain.account'].create({
             'namespace': 'paypal',
             'name': 'Paypal',
@@ -73,7 +84,7 @@ class PaypalScenario(object):
                 'description':
                     u'SO002|deltapc@yourcompany.example.com|%s' %
                     transaction.id},
-            ]}, api="123")
+            ]}, api=paypalrestsdk.Api.return_value)
 
         self.assertEqual(transaction.name, self.sale.name)
         self.assertEqual(
@@ -117,6 +128,15 @@ class PaypalScenario(object):
             self._check_failing_return(transaction, result)
             self.assertNotEqual(transaction.error, '')
 
+    def test_access_token_shared(self):
+        with paypal_mock(PaypalPaymentSuccess):
+            transaction = self._create_transaction(**REDIRECT_URL)
+            self._simulate_return(transaction.external_id)
+            api = paypalrestsdk.Api.return_value
+            self.assertEqual(api.get_token_hash.call_count, 1)
+            self.assertEqual(
+                api.token_hash['access_token'], TOKEN_HASH['access_token'])
+
     def test_wrong_transaction(self):
         with paypal_mock(PaypalPaymentSuccess):
             self._create_transaction(**REDIRECT_URL)
@@ -137,3 +157,231 @@ class PaypalCase(PaypalCommonCase, PaypalScenario):
         with self.env['gateway.transaction']._get_provider('paypal')\
                 as provider:
             return provider.process_return(paymentId=transaction_id)
+
+    def test_current_transaction(self):
+        with paypal_mock(PaypalPaymentSuccess):
+            transaction_obj = self.env['gateway.transaction']
+            first = transaction_obj.generate(
+                'paypal', self.sale, **REDIRECT_URL)
+            self.assertEqual(self.sale.current_transaction_id, first)
+            last = transaction_obj.generate(
+                'paypal', self.sale, **REDIRECT_URL)
+            self.assertEqual(self.sale.current_transaction_id, last)
+            last.unlink()
+            self.assertEqual(self.sale.current_transaction_id, first)
+
+    def test_search_json(self):
+        with paypal_mock(PaypalPaymentSuccess):
+            transaction = self._create_transaction(**REDIRECT_URL)
+            transaction_obj = self.env['gateway.transaction']
+            self.assertEqual(
+                transaction_obj.search([('data.state', '=', 'created')]),
+                transaction)
+            self.assertEqual(
+                transaction_obj.search([
+                    ('data.transactions', '@>', [{'description': (
+                        transaction.name + u'|deltapc@yourcompany.example.com'
+                        u'|%s' % transaction.id)}])]),
+                transaction)
+            self.assertFalse(transaction_obj.search([
+                ('id', '=', transaction.id),
+                ('data.state', '!=', 'created')]))
+            transaction.meta = {'foo': {'bar': 1}, 'baz': 2}
+            self.assertEqual(
+                transaction_obj.search([('meta', '=', {'foo': {'bar': 1}})]),
+                transaction)
+            # the transactions without the key are different
+            self.assertEqual(
+                transaction_obj.search([
+                    ('id', '=', transaction.id),
+                    ('meta.missing', '!=', 'value')]),
+                transaction)
+
+    def test_legacy_json(self):
+        with paypal_mock(PaypalPaymentSuccess):
+            transaction = self._create_transaction(**REDIRECT_URL)
+        # the migrations keep the legacy text that are not a json
+        # as json strings
+        legacy = "{'state': u'approved'}"
+        self.env.cr.execute(
+            "UPDATE gateway_transaction_payload SET data = to_jsonb(%s::text)"
+            " WHERE transaction_id = %s", (legacy, transaction.id))
+        self.env.cr.execute(
+            "UPDATE gateway_transaction SET meta = to_jsonb('legacy'::text)"
+            " WHERE id = %s", (transaction.id,))
+        transaction.invalidate_cache()
+        self.assertEqual(transaction.data, legacy)
+        self.assertEqual(transaction.meta, 'legacy')
+        transaction.write({'data': transaction.data, 'meta': transaction.meta})
+        transaction.invalidate_cache()
+        self.assertEqual(transaction.data, legacy)
+        self.assertEqual(transaction.meta, 'legacy')
+        self.assertEqual(
+            self.env['gateway.transaction'].search(
+                [('id', '=', transaction.id), ('data.state', '=', 'created')]),
+            self.env['gateway.transaction'])
+
+    def test_search_payload(self):
+        with paypal_mock(PaypalPaymentSuccess):
+            transaction = self._create_transaction(**REDIRECT_URL)
+        transaction_obj = self.env['gateway.transaction']
+        domain = [('id', '=', transaction.id)]
+        self.assertEqual(transaction_obj.search(
+            domain + [('data', 'ilike', transaction.external_id)]),
+            transaction)
+        self.assertEqual(
+            transaction_obj.search(domain + [('error', '=', False)]),
+            transaction)
+        # an empty payload has no data
+        transaction.payload_ids.write({'data': {}, 'error': 'Refused'})
+        transaction.invalidate_cache()
+        self.assertIs(transaction.data, False)
+        self.assertEqual(
+            transaction_obj.search(domain + [('data', '=', False)]),
+            transaction)
+        self.assertEqual(
+            transaction_obj.search(domain + [('error', 'ilike', 'refused')]),
+            transaction)
+        self.assertEqual(
+            transaction_obj.search(domain + [('error', '=', False)]),
+            transaction_obj)
+
+    def test_generate_multi(self):
+        sales = self.sale | self.env.ref('sale.sale_order_3')
+        sales.write({'payment_mode_id': self.account_payment_mode.id})
+        # the paypal mock keep the last payment created
+        self.env['ir.config_parameter'].set_param(
+            'payment_gateway.generate_concurrency', '1')
+        with paypal_mock(PaypalPaymentSuccess):
+            transactions = self.env['gateway.transaction'].generate_multi(
+                'paypal', sales, **REDIRECT_URL)
+        self.assertEqual(len(transactions), 2)
+        self.assertEqual(
+            set(transactions.mapped('state')), set(['pending']))
+        for sale in sales:
+            self.assertEqual(sale.current_transaction_id.origin_id, sale)
+            self.assertEqual(sale.current_transaction_id, sale.transaction_ids)
+
+    def test_circuit_breaker(self):
+        transaction_obj = self.env['gateway.transaction']
+        with paypal_mock(PaypalPaymentServerError):
+            with transaction_obj._get_provider('paypal') as provider:
+                threshold = provider._breaker_failure_threshold
+            for i in range(threshold):
+                with self.assertRaises(paypalrestsdk.exceptions.ServerError):
+                    transaction_obj.generate(
+                        'paypal', self.sale, **REDIRECT_URL)
+            self.assertEqual(self.account_payment_mode.breaker_state, 'open')
+            self.assertEqual(
+                self.account_payment_mode.breaker_failure_count, threshold)
+            with self.assertRaises(ProviderUnavailable):
+                transaction_obj.generate('paypal', self.sale, **REDIRECT_URL)
+        self.account_payment_mode.reset_breaker()
+        self.account_payment_mode.invalidate_cache()
+        self.assertEqual(self.account_payment_mode.breaker_state, 'closed')
+        with paypal_mock(PaypalPaymentSuccess):
+            transaction = transaction_obj.generate(
+                'paypal', self.sale, **REDIRECT_URL)
+        self.assertEqual(transaction.state, 'pending')
+
+    def test_metrics(self):
+        def count():
+            for serie in METRICS.snapshot()['series']:
+                if serie[:3] == ['paypal', 'generate', 'success']:
+                    return serie[3]
+            return 0
+
+        before = count()
+        with paypal_mock(PaypalPaymentSuccess):
+            self._create_transaction(**REDIRECT_URL)
+        self.assertEqual(count(), before + 1)
+
+    def test_metrics_dead_process(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        metrics = Metrics()
+        metrics.directory = directory
+        metrics.observe('paypal', 'generate', 'success', 0.2)
+        metrics.flush()
+        metrics.mark_process_dead(metrics._pid)
+        metrics._reset()
+        metrics.observe('paypal', 'generate', 'success', 0.2)
+        metrics.flush()
+        series = metrics.collect()['series']
+        self.assertEqual(
+            series, [['paypal', 'generate', 'success', 2, 0.4,
+                      [0, 0, 2, 0, 0, 0, 0, 0, 0, 0]]])
+
+    def test_execute_transaction_payer_from_return(self):
+        # the payer is given by the return so the payment is not read
+        with paypal_mock(PaypalPaymentNoPayer):
+            transaction = self._create_transaction(**REDIRECT_URL)
+            with transaction._get_provider('paypal') as provider:
+                provider.process_return(
+                    paymentId=transaction.external_id,
+                    PayerID='4FRJVJRVRNBRE')
+        self.assertEqual(transaction.state, 'succeeded')
+        self.assertEqual(transaction.meta['paypal_payer_id'], '4FRJVJRVRNBRE')
+
+    def test_order(self):
+        self.account_payment_mode.paypal_flow = 'order'
+        with paypal_mock(PaypalPaymentSuccess):
+            api = paypalrestsdk.Api.return_value
+            api.post.side_effect = paypal_order_post
+            transaction = self._create_transaction(**REDIRECT_URL)
+            self.assertEqual(transaction.state, 'pending')
+            self.assertEqual(transaction.external_id, PAYPAL_ORDER['id'])
+            self.assertEqual(transaction.amount, self.sale.amount_total)
+            self.assertIn(PAYPAL_ORDER['id'], transaction.url)
+            with transaction._get_provider('paypal') as provider:
+                provider.process_return(
+                    token=transaction.external_id, PayerID='4FRJVJRVRNBRE')
+            self.assertEqual(transaction.state, 'succeeded')
+            # one request to create the order and one to capture it
+            self.assertEqual(api.post.call_count, 2)
+            self.assertFalse(api.get.called)
+
+    def test_order_capture_refused(self):
+        self.account_payment_mode.paypal_flow = 'order'
+        with paypal_mock(PaypalPaymentSuccess):
+            api = paypalrestsdk.Api.return_value
+            api.post.side_effect = paypal_order_post_refused
+            transaction = self._create_transaction(**REDIRECT_URL)
+            with transaction._get_provider('paypal') as provider:
+                provider.process_return(
+                    token=transaction.external_id, PayerID='4FRJVJRVRNBRE')
+        self.assertEqual(transaction.state, 'failed')
+        self.assertIn('UNPROCESSABLE_ENTITY', transaction.error)
+
+    def test_deferred_capture(self):
+        self.account_payment_mode.paypal_deferred_capture = True
+        with paypal_mock(PaypalPaymentSuccess):
+            transaction = self._create_transaction(**REDIRECT_URL)
+            self._init_job_counter()
+            self._simulate_return(transaction.external_id)
+            self.assertEqual(transaction.state, 'pending')
+            self._check_nbr_job_created(1)
+            self.assertEqual(self.created_jobs.method_name, 'capture')
+            self._perform_created_job()
+        self.assertEqual(transaction.state, 'succeeded')
+
+    def test_capture_breaker_open(self):
+        self.account_payment_mode.paypal_deferred_capture = True
+        with paypal_mock(PaypalPaymentSuccess):
+            transaction = self._create_transaction(**REDIRECT_URL)
+            self._simulate_return(transaction.external_id)
+        with transaction._get_provider() as provider:
+            account_id = provider._get_credentials()['id']
+        self.env['gateway.circuit.breaker'].create({
+            'provider': 'paypal',
+            'account_id': account_id,
+            'state': 'open',
+            'opened_at': fields.Datetime.now(),
+            })
+        self._init_job_counter()
+        self.assertFalse(transaction.capture())
+        self.assertEqual(transaction.state, 'pending')
+        # the capture is done again once the breaker is half open
+        self._check_nbr_job_created(1)
+        self.assertEqual(self.created_jobs.method_name, 'capture_chunk')
+        self.assertTrue(self.created_jobs.eta)
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo import api, models
+from odoo.addons.queue_job.job import job
+import requests
+
+
+class GatewayTransaction(models.Model):
+    _inherit = 'gateway.transaction'
+
+    @job(default_channel='root.gateway.webhook')
+    @api.model
+    def simulator_send_webhook(self, params, mode='job'):
+        """Send the webhook of the simulator, with 'job' the event is
+        enqueued as if it had been received by the webhook controller,
+        with 'http' it's posted to the webhook controller"""
+        if mode == 'http':
+            url = self.env['ir.config_parameter'].sudo().get_param(
+                'web.base.url') + \
+                '/payment-gateway-json-webhook/simulator/process_event'
+            response = requests.post(url, json=params, timeout=30)
+            response.raise_for_status()
+            return True
+        self._enqueue_webhook('simulator', 'process_event', params)
+        return True
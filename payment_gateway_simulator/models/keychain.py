@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo import fields, models
+import json
+
+# rates are between 0 and 1, delays and latencies are in seconds
+SIMULATOR_DEFAULT_DATA = {
+    # latency of the calls, lognormal distribution with this median
+    # and sigma, limited to latency_max
+    'latency': 0.2,
+    'latency_sigma': 0.5,
+    'latency_max': 10,
+    # rate of the calls failing because the provider is down
+    'outage_rate': 0,
+    # rate of the payments declined
+    'decline_rate': 0.05,
+    # rate of the payments redirected to 3D secure and rate of the
+    # 3D secure validations succeeding
+    'three_d_secure_rate': 0.3,
+    'three_d_secure_success_rate': 0.9,
+    # delay before the customer return from the 3D secure validation,
+    # the webhook is then sent with a 'job' or 'http' request (or 'none')
+    'webhook_delay': 30,
+    'webhook_mode': 'job',
+    }
+
+
+class KeychainAccount(models.Model):
+    _inherit = 'keychain.account'
+
+    namespace = fields.Selection(
+        selection_add=[('simulator', 'Simulator')])
+
+    def _simulator_init_data(self):
+        return dict(SIMULATOR_DEFAULT_DATA)
+
+    def _simulator_validate_data(self, data):
+        if not isinstance(data, dict):
+            try:
+                data = json.loads(data or '{}')
+            except ValueError:
+                return False
+        for key, value in data.items():
+            if key == 'webhook_mode':
+                if value not in ('job', 'http', 'none'):
+                    return False
+            elif key.endswith('_rate'):
+                if not 0 <= value <= 1:
+                    return False
+            elif key in SIMULATOR_DEFAULT_DATA and value < 0:
+                return False
+        return True
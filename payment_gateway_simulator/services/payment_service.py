@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo.exceptions import UserError
+from odoo.tools.translate import _
+from odoo.addons.component.core import Component
+from odoo.addons.payment_gateway.exceptions import ProviderConnectionError
+from odoo.addons.payment_gateway_simulator.models.keychain import (
+    SIMULATOR_DEFAULT_DATA)
+import json
+import logging
+import random
+import time
+import uuid
+_logger = logging.getLogger(__name__)
+
+
+def _simulate_call(config):
+    """Wait the latency of the provider and raise an error if the
+    provider is down. Do not use the ORM as it's called in the threads
+    of generate_multi.
+    The draws use the generator of the module and not the one of the
+    transaction, so a call retried can succeed"""
+    latency = random.lognormvariate(0, config['latency_sigma']) \
+        * config['latency']
+    time.sleep(min(latency, config['latency_max']))
+    if random.random() < config['outage_rate']:
+        raise ProviderConnectionError(
+            _('The simulated provider is not available'))
+
+
+class PaymentService(Component):
+    _inherit = 'payment.service'
+    _name = 'payment.service.simulator'
+    _allowed_capture_method = ['immediately']
+    _webhook_method = ['process_event']
+
+    def _get_config(self):
+        config = dict(SIMULATOR_DEFAULT_DATA)
+        config.update(self._get_credentials()['data'])
+        return config
+
+    def _get_random(self, config):
+        """Return the random generator of the transaction, with a seed
+        in the configuration the simulation is reproducible"""
+        if config.get('seed') is not None:
+            return random.Random('%s-%s' % (
+                config['seed'], self.collection.id))
+        return random.Random()
+
+    def _get_redirect_url(self, external_id, return_url=None, **kwargs):
+        # the customer is sent back directly, the 3D secure is validated
+        # or not when the webhook is sent
+        if return_url:
+            separator = '&' if '?' in return_url else '?'
+            return '%s%ssource=%s' % (return_url, separator, external_id)
+        return None
+
+    # Code for generating the transaction on the simulator
+
+    def _prepare_create_transaction(self, **kwargs):
+        config = self._get_config()
+        rand = self._get_random(config)
+        need_3d_secure = self._transaction_need_3d_secure()
+        amount = self.collection._get_amount_to_capture()
+        currency = self.collection.currency_id.name
+        declined = _('The card was declined.')
+
+        def create():
+            _simulate_call(config)
+            if rand.random() < config['decline_rate']:
+                raise UserError(declined)
+            external_id = 'sim_%s' % uuid.uuid4().hex
+            res = {
+                'id': external_id,
+                'amount': amount,
+                'currency': currency,
+                'three_d_secure': False,
+                'status': 'succeeded',
+                'outcome': 'succeeded',
+                'ready_at': time.time(),
+                }
+            if need_3d_secure and \
+                    rand.random() < config['three_d_secure_rate']:
+                res.update({
+                    'three_d_secure': True,
+                    'status': 'pending',
+                    'redirect_url': self._get_redirect_url(
+                        external_id, **kwargs),
+                    'ready_at': time.time() + config['webhook_delay'],
+                    })
+                if rand.random() >= config['three_d_secure_success_rate']:
+                    res['outcome'] = 'failed'
+            return res
+
+        return create
+
+    def _create_transaction(self, **kwargs):
+        return self._prepare_create_transaction(**kwargs)()
+
+    def _parse_creation_result(self, transaction, **kwargs):
+        res = {
+            'amount': transaction['amount'],
+            'external_id': transaction['id'],
+            'state': transaction['status'],
+            'data': json.dumps(transaction),
+            'used_3d_secure': transaction['three_d_secure'],
+            'meta': {'simulator': {
+                'ready_at': transaction['ready_at'],
+                'outcome': transaction['outcome'],
+                }},
+            }
+        if transaction.get('redirect_url'):
+            res['url'] = transaction['redirect_url']
+        return res
+
+    def _write_creation_result(self, transaction, **kwargs):
+        res = super(PaymentService, self)._write_creation_result(
+            transaction, **kwargs)
+        if transaction['status'] == 'pending':
+            self._schedule_webhook(transaction)
+        return res
+
+    def _schedule_webhook(self, transaction):
+        """Send the webhook of the transaction when the simulated customer
+        has filled the 3D secure"""
+        config = self._get_config()
+        if config['webhook_mode'] == 'none':
+            return
+        self.env['gateway.transaction'].with_delay(
+            eta=int(config['webhook_delay'])
+            ).simulator_send_webhook({
+                'id': 'evt_%s' % uuid.uuid4().hex,
+                'external_id': transaction['id'],
+                }, mode=config['webhook_mode'])
+
+    # code for getting the state of the current transaction
+
+    def get_state(self):
+        config = self._get_config()
+        _simulate_call(config)
+        transaction = self.collection
+        simulator = (transaction.meta or {}).get('simulator')
+        if not simulator:
+            raise UserError(
+                _('The transaction %s do not exist') % transaction.external_id)
+        if time.time() < simulator['ready_at']:
+            return 'pending'
+        return simulator['outcome']
+
+    # Code for capturing the transaction
+
+    def capture(self):
+        config = self._get_config()
+        _simulate_call(config)
+        self.collection.write({'state': 'succeeded'})
+
+    # Code for the return of the customer and the webhook
+
+    def process_return(self, **params):
+        transaction = self.env['gateway.transaction'].search([
+            ('external_id', '=', params['source']),
+            ('provider', '=', 'simulator'),
+            ('state', '=', 'pending')])
+        transaction.check_state()
+        return transaction
+
+    def process_event(self, **params):
+        transaction = self.env['gateway.transaction'].search([
+            ('external_id', '=', params['external_id']),
+            ('provider', '=', 'simulator'),
+            ])
+        if transaction:
+            transaction.check_state()
+        else:
+            raise UserError(
+                _('The transaction %s do not exist') % params['external_id'])
+
+    def _get_webhook_event_key(self, method_name, params):
+        return params.get('id') or super(
+            PaymentService, self)._get_webhook_event_key(method_name, params)
+
+    def _get_webhook_external_id(self, method_name, params):
+        if method_name == 'process_event':
+            return params.get('external_id')
+        return super(PaymentService, self)._get_webhook_external_id(
+            method_name, params)
+
+    def _validator_process_event(self):
+        return {
+            'id': {'type': 'string'},
+            'external_id': {'type': 'string', 'required': True},
+            }
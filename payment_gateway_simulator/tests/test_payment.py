@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import json
+from datetime import datetime, timedelta
+
+from odoo import fields
+from odoo.exceptions import UserError
+from odoo.addons.payment_gateway.exceptions import ProviderConnectionError
+from odoo.addons.payment_gateway.tests.common import HttpComponentCase
+
+
+class SimulatorCase(HttpComponentCase):
+
+    def setUp(self, *args, **kwargs):
+        super(SimulatorCase, self).setUp(*args, **kwargs)
+        self.account = self.env['keychain.account'].create({
+            'namespace': 'simulator',
+            'name': 'Simulator',
+            'clear_password': 'simulator',
+            'technical_name': 'simulator',
+            'data': '{}'})
+        self.sale = self.env.ref('sale.sale_order_2')
+        self.account_payment_mode = self.env.ref(
+            'payment_gateway_simulator.account_payment_mode_simulator')
+        self.sale.write({'payment_mode_id': self.account_payment_mode.id})
+
+    def _configure(self, **kwargs):
+        config = {
+            'latency': 0,
+            'latency_max': 0,
+            'decline_rate': 0,
+            'three_d_secure_rate': 0,
+            'three_d_secure_success_rate': 1,
+            'webhook_delay': 0,
+            'seed': 42,
+            }
+        config.update(kwargs)
+        self.account.write({'data': json.dumps(config)})
+
+    def _create_transaction(self):
+        return self.env['gateway.transaction'].generate(
+            'simulator', self.sale, return_url='https://IwillBeBack.vd')
+
+    def test_create_transaction(self):
+        self._configure()
+        transaction = self._create_transaction()
+        self.assertEqual(transaction.state, 'succeeded')
+        self.assertEqual(transaction.amount, self.sale.amount_total)
+        self.assertEqual(transaction.used_3d_secure, False)
+
+    def test_create_transaction_3d_secure(self):
+        self._configure(three_d_secure_rate=1)
+        self._init_job_counter()
+        transaction = self._create_transaction()
+        self.assertEqual(transaction.state, 'pending')
+        self.assertEqual(transaction.used_3d_secure, True)
+        self.assertIn(transaction.external_id, transaction.url)
+        # the simulator send the webhook which is then processed
+        self._check_nbr_job_created(1)
+        self._perform_created_job()
+        self._check_nbr_job_created(2)
+        webhook_job = self.created_jobs.filtered(
+            lambda job: job.method_name == 'process_webhook')
+        self.assertEqual(
+            webhook_job.channel, 'root.gateway.webhook.simulator')
+        # the event is already registered so sending it again is ignored
+        self._perform_created_job()
+        self.assertEqual(transaction.state, 'succeeded')
+
+    def test_create_transaction_3d_secure_failed(self):
+        self._configure(three_d_secure_rate=1, three_d_secure_success_rate=0)
+        transaction = self._create_transaction()
+        with transaction._get_provider('simulator') as provider:
+            provider.process_return(source=transaction.external_id)
+        self.assertEqual(transaction.state, 'failed')
+
+    def test_create_transaction_declined(self):
+        self._configure(decline_rate=1)
+        with self.assertRaises(UserError):
+            self._create_transaction()
+
+    def test_create_transaction_outage(self):
+        self._configure(outage_rate=1)
+        with self.assertRaises(ProviderConnectionError):
+            self._create_transaction()
+
+    def test_generate_multi(self):
+        self._configure(decline_rate=0.5)
+        transactions = self.env['gateway.transaction'].generate_multi(
+            'simulator', self.sale.browse([self.sale.id] * 20))
+        self.assertEqual(
+            set(transactions.mapped('state')), set(['succeeded', 'failed']))
+
+    def test_config(self):
+        self.assertEqual(
+            self.account_payment_mode._get_allowed_capture_method(),
+            ['immediately'])
+
+    def _create_pending_transaction(self, age, **kwargs):
+        self._configure(
+            three_d_secure_rate=1, webhook_mode='none', **kwargs)
+        transaction = self._create_transaction()
+        self.env.cr.execute("""
+            UPDATE gateway_transaction SET create_date = %s WHERE id = %s
+            """, (fields.Datetime.to_string(datetime.now() - age),
+                  transaction.id))
+        transaction.invalidate_cache()
+        return transaction
+
+    def test_cron_check_pending_state(self):
+        ready = self._create_pending_transaction(timedelta(minutes=10))
+        waiting = self._create_pending_transaction(
+            timedelta(minutes=10), webhook_delay=3600)
+        expired = self._create_pending_transaction(
+            timedelta(days=2), webhook_delay=3600)
+        recent = self._create_pending_transaction(timedelta(0))
+        now = datetime.now().replace(microsecond=0)
+        self.env['gateway.transaction']._cron_check_pending_state()
+        self.assertEqual(ready.state, 'succeeded')
+        self.assertEqual(expired.state, 'abandoned')
+        self.assertEqual(waiting.state, 'pending')
+        self.assertEqual(waiting.check_state_count, 1)
+        self.assertGreaterEqual(
+            fields.Datetime.from_string(waiting.date_next_check),
+            now + timedelta(seconds=60))
+        # the transactions are only checked a minute after their creation
+        self.assertEqual(recent.state, 'pending')
+        self.assertEqual(recent.check_state_count, 0)
+
+    def test_cron_check_pending_state_missing_provider(self):
+        missing = self._create_pending_transaction(timedelta(minutes=10))
+        ready = self._create_pending_transaction(timedelta(minutes=10))
+        self.env.cr.execute("""
+            UPDATE gateway_transaction SET provider = 'uninstalled'
+            WHERE id = %s
+            """, (missing.id,))
+        missing.invalidate_cache()
+        self.env['gateway.transaction']._cron_check_pending_state()
+        self.assertEqual(ready.state, 'succeeded')
+        self.assertEqual(missing.state, 'pending')
+        self.assertEqual(missing.check_state_count, 1)
+
+    def test_schedule_next_check(self):
+        transaction = self._create_pending_transaction(timedelta(0))
+        now = datetime.now()
+        for count, delay in [(0, 60), (1, 120), (2, 240), (10, 3600)]:
+            transaction.check_state_count = count
+            transaction._schedule_next_check(now)
+            self.assertEqual(transaction.check_state_count, count + 1)
+            self.assertEqual(
+                transaction.date_next_check,
+                fields.Datetime.to_string(now + timedelta(seconds=delay)))
+
+    def _create_to_capture(self, count):
+        transaction_obj = self.env['gateway.transaction']
+        vals = transaction_obj._prepare_transaction(self.sale)
+        transactions = transaction_obj.browse()
+        for i in range(count):
+            transactions |= transaction_obj.create(
+                dict(vals, state='to_capture'))
+        return transactions
+
+    def test_capture(self):
+        self._configure()
+        transaction = self._create_to_capture(1)
+        transaction.capture()
+        self.assertEqual(transaction.state, 'succeeded')
+        self.assertTrue(transaction.date_processing)
+
+    def test_capture_outage(self):
+        self._configure(outage_rate=1)
+        transaction = self._create_to_capture(1)
+        transaction.capture()
+        self.assertEqual(transaction.state, 'failed')
+        self.assertTrue(transaction.error)
+        # the outage is drawn again when the call is retried, even with
+        # the seed of the configuration
+        self._configure(outage_rate=0.5)
+        for attempt in range(30):
+            self.account_payment_mode.reset_breaker()
+            transaction.write({'state': 'to_capture', 'error': False})
+            if transaction.state == 'succeeded':
+                break
+        self.assertEqual(transaction.state, 'succeeded')
@@ -22,6 +22,7 @@
     ],
     "data": [
         "data/account_payment_mode_data.xml",
+        "views/account_payment_mode_view.xml",
     ],
     "demo": [
     ],
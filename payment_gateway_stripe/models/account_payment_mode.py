@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Akretion (http://www.akretion.com).
+# @author Sébastien BEAU <sebastien.beau@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo import fields, models
+
+
+class AccountPaymentMode(models.Model):
+    _inherit = 'account.payment.mode'
+
+    stripe_flow = fields.Selection([
+        ('source', 'Sources and Charges'),
+        ('payment_intent', 'Payment Intents'),
+        ], default='source',
+        help="With Payment Intents the payment is created and confirmed "
+             "in one request and captured by stripe once confirmed")
@@ -3,10 +3,13 @@
 # @author Sébastien BEAU <sebastien.beau@akretion.com>
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
+from odoo import fields
 from odoo.exceptions import Warning as UserError
 from odoo.tools.translate import _
 from odoo.tools.float_utils import float_round
 from odoo.addons.component.core import Component
+from datetime import datetime, timedelta
+import calendar
 import json
 import logging
 _logger = logging.getLogger(__name__)
@@ -25,6 +28,33 @@ MAP_SOURCE_STATE = {
     'pending': 'pending',
     'succeeded': 'succeeded'}
 
+MAP_INTENT_STATE = {
+    'requires_payment_method': 'failed',
+    'requires_source': 'failed',
+    'requires_confirmation': 'pending',
+    'requires_action': 'pending',
+    'requires_source_action': 'pending',
+    'processing': 'pending',
+    'requires_capture': 'to_capture',
+    'canceled': 'cancel',
+    'succeeded': 'succeeded'}
+
+# stripe only list the events of the last 30 days
+EVENT_RETENTION_DAYS = 29
+
+# events changing the status of a source
+SOURCE_EVENT_TYPES = ['source.chargeable', 'source.failed', 'source.canceled']
+
+# number of seconds a signed event is accepted after its signature
+WEBHOOK_TOLERANCE = 300
+
+# states a signed event can move a transaction to, a late event on a
+# transaction already processed is ignored
+VERIFIED_EVENT_TRANSITIONS = {
+    'pending': ['to_capture', 'succeeded', 'failed', 'cancel'],
+    'to_capture': ['succeeded', 'cancel'],
+    }
+
 # zero decimal currency https://stripe.com/docs/currencies#zero-decimal
 ZERO_DECIMAL_CURRENCIES = [
     u'BIF', u'CLP', u'DJF', u'GNF', u'JPY', u'KMF', u'KRW', u'MGA',
@@ -37,11 +67,14 @@ class PaymentService(Component):
     _name = 'payment.service.stripe'
     _allowed_capture_method = ['immediately']
     _webhook_method = ['process_event']
+    _event_min_transactions = 10
 
     def process_return(self, **params):
+        # stripe add the id of the payment intent to the return url
+        external_id = params.get('payment_intent') or params['source']
         transaction = self.env['gateway.transaction'].search([
-            ('external_id', '=', params['source']),
-            ('payment_mode_id.provider', '=', 'stripe'),
+            ('external_id', '=', external_id),
+            ('provider', '=', 'stripe'),
             ('state', '=', 'pending')])
         transaction.check_state()
         return transaction
@@ -52,7 +85,7 @@ class PaymentService(Component):
         # Receving the webhook will force to update the related transaction
         transaction = self.env['gateway.transaction'].search([
             ('external_id', '=', transaction_id),
-            ('payment_mode_id.provider', '=', 'stripe'),
+            ('provider', '=', 'stripe'),
             ])
         if transaction:
             transaction.check_state()
@@ -60,6 +93,61 @@ class PaymentService(Component):
             raise UserError(
                 _('The transaction %s do not exist') % transaction_id)
 
+    def process_event_verified(self, **params):
+        """Apply the state of the source of a signed event, the source
+        is fetched if the event is older than the last one applied.
+        Only the forward moves of VERIFIED_EVENT_TRANSITIONS are applied"""
+        source = params['data']['object']
+        transaction = self.env['gateway.transaction'].search([
+            ('external_id', '=', source['id']),
+            ('provider', '=', 'stripe'),
+            ])
+        if not transaction:
+            raise UserError(
+                _('The transaction %s do not exist') % source['id'])
+        if source.get('object') == 'payment_intent':
+            map_state = MAP_INTENT_STATE
+        else:
+            map_state = MAP_SOURCE_STATE
+        meta = dict(transaction.meta or {})
+        last_created = meta.get('stripe_event_created')
+        if source.get('status') not in map_state or (
+                last_created and params['created'] <= last_created):
+            return transaction.check_state()
+        state = map_state[source['status']]
+        if state != transaction.state and state not in \
+                VERIFIED_EVENT_TRANSITIONS.get(transaction.state, []):
+            _logger.info(
+                'Event %s ignored, transaction %s is already %s',
+                params.get('id'), transaction.id, transaction.state)
+            return False
+        meta['stripe_event_created'] = params['created']
+        transaction.write({'meta': meta})
+        transaction._write_states({transaction.id: state})
+
+    def _verify_webhook(self, method_name, payload, headers):
+        secret = self._get_credentials()['data'].get('webhook_secret')
+        signature = headers.get('Stripe-Signature')
+        if not secret or not signature:
+            return False
+        try:
+            stripe.WebhookSignature.verify_header(
+                payload, signature, secret, tolerance=WEBHOOK_TOLERANCE)
+        except stripe.error.SignatureVerificationError as e:
+            _logger.warning('Invalid signature of stripe event: %s', e)
+            return False
+        return True
+
+    def _get_webhook_event_key(self, method_name, params):
+        return params.get('id') or super(
+            PaymentService, self)._get_webhook_event_key(method_name, params)
+
+    def _get_webhook_external_id(self, method_name, params):
+        if method_name == 'process_event':
+            return params.get('data', {}).get('object', {}).get('id')
+        return super(PaymentService, self)._get_webhook_external_id(
+            method_name, params)
+
     def _validator_process_event(self):
         return {
             'data': {
@@ -75,6 +163,27 @@ class PaymentService(Component):
             }
         }
 
+    def _validator_process_event_verified(self):
+        return {
+            'id': {'type': 'string'},
+            'created': {'type': 'integer', 'required': True},
+            'data': {
+                'type': 'dict',
+                'required': True,
+                'schema': {
+                    'object': {
+                        'type': 'dict',
+                        'required': True,
+                        'schema': {
+                            'id': {'type': 'string', 'required': True},
+                            'object': {'type': 'string'},
+                            'status': {'type': 'string'},
+                        }
+                    }
+                }
+            }
+        }
+
     def _validator_add_payment(self):
         return {
             'token': {'type': 'string'},
@@ -87,8 +196,18 @@ class PaymentService(Component):
 
     @property
     def _api_key(self):
-        account = self._get_account()
-        return account._get_password()
+        # the key is read before each request, so it's the place
+        # to ensure that stripe use the pooled session
+        self._bind_http_client()
+        return self._get_credentials()['password']
+
+    def _bind_http_client(self):
+        """Send the requests of stripe with the pooled http session"""
+        session = self._get_http_session()
+        client = stripe.default_http_client
+        if getattr(client, '_session', None) is not session:
+            stripe.default_http_client = stripe.http_client.RequestsClient(
+                session=session, timeout=session.timeout)
 
     def _get_formatted_amount(self):
         amount = self.collection._get_amount_to_capture()
@@ -156,29 +275,99 @@ class PaymentService(Component):
             'api_key': self._api_key,
         }
 
-    def _create_transaction(self, token=None, **kwargs):
-        source_data = stripe.Source.retrieve(token, api_key=self._api_key)
-        if source_data['card']['three_d_secure'] == 'not_supported':
-            three_d_secure = False
+    def _get_flow(self):
+        return self.collection.payment_mode_id.stripe_flow or 'source'
+
+    def _prepare_payment_intent(self, token=None, return_url=None, **kwargs):
+        transaction = self.collection
+        if self._transaction_need_3d_secure():
+            request_three_d_secure = 'any'
         else:
-            three_d_secure = self._transaction_need_3d_secure()
-        try:
+            request_three_d_secure = 'automatic'
+        return {
+            'amount': self._get_formatted_amount(),
+            'currency': transaction.currency_id.name,
+            'payment_method': token,
+            'description': "|".join([
+                transaction.name,
+                transaction.partner_id.email,
+                str(transaction.id)]),
+            # only the immediate capture is supported, stripe capture the
+            # payment intent once confirmed so it is never captured by odoo
+            'capture_method': 'automatic',
+            'payment_method_options': {'card': {
+                'request_three_d_secure': request_three_d_secure}},
+            'confirm': True,
+            'return_url': return_url,
+            'api_key': self._api_key,
+            }
+
+    def _prepare_create_transaction(self, token=None, **kwargs):
+        if self._get_flow() == 'payment_intent':
+            # the payment intent is created and confirmed in one request,
+            # stripe decide if the 3D secure is needed
+            intent_vals = self._prepare_payment_intent(token=token, **kwargs)
+            return lambda: stripe.PaymentIntent.create(**intent_vals)
+        api_key = self._api_key
+        need_3d_secure = self._transaction_need_3d_secure()
+        source_vals = self._prepare_3d_source(token=token, **kwargs)
+        charge_vals = self._prepare_charge(token=token, **kwargs)
+
+        def create():
+            source_data = stripe.Source.retrieve(token, api_key=api_key)
+            if source_data['card']['three_d_secure'] == 'not_supported':
+                three_d_secure = False
+            else:
+                three_d_secure = need_3d_secure
             if three_d_secure:
-                res = stripe.Source.create(
-                    **self._prepare_3d_source(token=token, **kwargs))
-                if res['status'] == 'chargeable':
-                    # 3D secure has not been activated or is not ready
-                    # for this customer
-                    three_d_secure = False
-                else:
+                res = stripe.Source.create(**source_vals)
+                if res['status'] != 'chargeable':
                     return res
-            if not three_d_secure:
-                return stripe.Charge.create(
-                    **self._prepare_charge(token=token, **kwargs))
+                # 3D secure has not been activated or is not ready
+                # for this customer
+            return stripe.Charge.create(**charge_vals)
+
+        return create
+
+    def _create_transaction(self, **kwargs):
+        try:
+            return self._prepare_create_transaction(**kwargs)()
         except stripe.error.CardError as e:
-            raise UserError(self._get_error_message(e.code))
+            raise UserError(self._get_creation_error_message(e))
+
+    def _is_outage_error(self, error):
+        if isinstance(error, stripe.error.APIConnectionError):
+            return True
+        elif isinstance(error, stripe.error.APIError):
+            return (error.http_status or 500) >= 500
+        return super(PaymentService, self)._is_outage_error(error)
+
+    def _get_creation_error_message(self, error):
+        if isinstance(error, stripe.error.CardError):
+            return self._get_error_message(error.code)
+        return super(PaymentService, self)._get_creation_error_message(error)
+
+    def _parse_payment_intent(self, intent):
+        res = {
+            'amount': intent['amount']/100.,
+            'external_id': intent['id'],
+            'state': MAP_INTENT_STATE[intent['status']],
+            'data': json.dumps(intent),
+            }
+        next_action = intent.get('next_action') or {}
+        if next_action.get('redirect_to_url'):
+            res['url'] = next_action['redirect_to_url']['url']
+            res['used_3d_secure'] = True
+        charges = (intent.get('charges') or {}).get('data') or []
+        risk_level = charges and charges[0].get('outcome', {}).get(
+            'risk_level')
+        if risk_level:
+            res['risk_level'] = risk_level
+        return res
 
     def _parse_creation_result(self, transaction, **kwargs):
+        if transaction.get('object') == 'payment_intent':
+            return self._parse_payment_intent(transaction)
         res = {
             'amount': transaction['amount']/100.,
             'external_id': transaction['id'],
@@ -196,10 +385,63 @@ class PaymentService(Component):
     # code for getting the state of the current transaction
 
     def get_state(self):
+        if self.collection.external_id.startswith('pi_'):
+            intent = stripe.PaymentIntent.retrieve(
+                self.collection.external_id, api_key=self._api_key)
+            return MAP_INTENT_STATE[intent['status']]
         source = stripe.Source.retrieve(
             self.collection.external_id, api_key=self._api_key)
         return MAP_SOURCE_STATE[source['status']]
 
+    def get_states(self):
+        transactions = self.collection
+        if len(transactions) < self._event_min_transactions:
+            # reading the events is only worth it for many transactions
+            return super(PaymentService, self).get_states()
+        since = fields.Datetime.to_string(
+            datetime.now() - timedelta(days=EVENT_RETENTION_DAYS))
+        recent = transactions.filtered(
+            lambda r: r.create_date > since
+            and (r.external_id or '').startswith('src_'))
+        states = self._fetch_states_from_events(recent)
+        states.update(self._fetch_states_by_page(transactions - recent))
+        return states
+
+    def _fetch_states_from_events(self, transactions):
+        """Sources do not have a list endpoint, so we read the last
+        source event of each transaction in the event list instead.
+        A transaction without event since its creation have not changed"""
+        if not transactions:
+            return {}
+        oldest = fields.Datetime.from_string(
+            min(transactions.mapped('create_date')))
+        transaction_ids = {t.external_id: t.id for t in transactions}
+        states = {t.id: t.state for t in transactions}
+        # only the events since the creation of the oldest transaction
+        # are read, and the reading stops once all the transactions
+        # have their last event
+        events = stripe.Event.list(
+            types=SOURCE_EVENT_TYPES,
+            created={'gte': calendar.timegm(oldest.timetuple())},
+            limit=100,
+            api_key=self._api_key)
+        seen = set()
+        # events are sorted from the newest to the oldest
+        for event in events.auto_paging_iter():
+            source = event['data']['object']
+            if source['id'] in transaction_ids and source['id'] not in seen:
+                seen.add(source['id'])
+                state = MAP_SOURCE_STATE.get(source['status'])
+                if state:
+                    states[transaction_ids[source['id']]] = state
+                else:
+                    _logger.warning(
+                        'Unknown status %s of stripe source %s',
+                        source['status'], source['id'])
+                if len(seen) == len(transaction_ids):
+                    break
+        return states
+
     # Code for capturing the transaction
 
     def _parse_capture_result(self, charge):
@@ -3,9 +3,13 @@
 # @author Sébastien BEAU <sebastien.beau@akretion.com>
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
+import hashlib
+import hmac
 import os
 import json
+import mock
 import requests
+import time
 import stripe
 from os.path import dirname
 
@@ -172,3 +176,109 @@ class StripeCase(StripeCommonCase, StripeScenario):
         self.assertEqual(
             self.account_payment_mode._get_allowed_capture_method(),
             ['immediately'])
+
+    def _sign_event(self, event, secret):
+        payload = json.dumps(event)
+        timestamp = int(time.time())
+        signature = hmac.new(
+            secret, '%d.%s' % (timestamp, payload), hashlib.sha256
+            ).hexdigest()
+        return payload, {
+            'Stripe-Signature': 't=%d,v1=%s' % (timestamp, signature)}
+
+    def _enqueue_signed_event(self, secret, status='failed', state='pending'):
+        self.env['keychain.account'].search(
+            [('namespace', '=', 'stripe')]).write(
+            {'data': json.dumps({'webhook_secret': 'whsec_test'})})
+        transaction_obj = self.env['gateway.transaction']
+        transaction = transaction_obj.create(dict(
+            transaction_obj._prepare_transaction(self.sale),
+            external_id='src_1CiPtu2eZvKYlo2CXHNJoXXU',
+            state=state))
+        event = {
+            'id': 'evt_1CiPtu2eZvKYlo2CvKxUtIuH',
+            'created': 1530000000,
+            'data': {'object': {
+                'id': transaction.external_id,
+                'status': status,
+                }},
+            }
+        payload, headers = self._sign_event(event, secret)
+        job = transaction_obj._enqueue_webhook(
+            'stripe', 'process_event', event,
+            payload=payload, headers=headers)
+        return transaction, job
+
+    def test_webhook_verified(self):
+        self._init_job_counter()
+        transaction, job = self._enqueue_signed_event('whsec_test')
+        self.assertTrue(job.kwargs.get('verified'))
+        # the state of the event is applied without fetching the source
+        self._perform_created_job()
+        self.assertEqual(transaction.state, 'failed')
+        self.assertEqual(transaction.meta['stripe_event_created'], 1530000000)
+
+    def test_webhook_verified_late_event(self):
+        # the chargeable event is received after the synchronous capture,
+        # the transaction must not go back to capture
+        self._init_job_counter()
+        transaction, job = self._enqueue_signed_event(
+            'whsec_test', status='chargeable', state='succeeded')
+        self._perform_created_job()
+        self.assertEqual(transaction.state, 'succeeded')
+        self.assertFalse(transaction.meta.get('stripe_event_created'))
+
+    def test_webhook_invalid_signature(self):
+        transaction, job = self._enqueue_signed_event('whsec_wrong')
+        self.assertFalse(job.kwargs.get('verified'))
+
+    def test_parse_payment_intent(self):
+        intent = {
+            'id': 'pi_1CiPtu2eZvKYlo2CDp0TEHWq',
+            'object': 'payment_intent',
+            'amount': 4200,
+            'status': 'requires_action',
+            'next_action': {
+                'type': 'redirect_to_url',
+                'redirect_to_url': {'url': 'https://hooks.stripe.com/3d'},
+                },
+            }
+        transaction = self.env['gateway.transaction'].browse()
+        with transaction._get_provider('stripe') as provider:
+            vals = provider._parse_creation_result(intent)
+        self.assertEqual(vals['state'], 'pending')
+        self.assertEqual(vals['amount'], 42)
+        self.assertEqual(vals['url'], 'https://hooks.stripe.com/3d')
+        self.assertTrue(vals['used_3d_secure'])
+
+    def test_create_payment_intent(self):
+        self.account_payment_mode.stripe_flow = 'payment_intent'
+        intent = {
+            'id': 'pi_1CiPtu2eZvKYlo2CDp0TEHWq',
+            'object': 'payment_intent',
+            'amount': int(round(self.sale.amount_total * 100)),
+            'status': 'succeeded',
+            'charges': {'data': [{'outcome': {'risk_level': 'normal'}}]},
+            }
+        with mock.patch.object(stripe, 'PaymentIntent') as payment_intent:
+            payment_intent.create.return_value = intent
+            transaction = self.env['gateway.transaction'].generate(
+                'stripe', self.sale, token='pm_card_visa',
+                return_url='https://IwillBeBack.vd')
+            vals = payment_intent.create.call_args[1]
+            self.assertEqual(vals['payment_method'], 'pm_card_visa')
+            self.assertEqual(vals['amount'], intent['amount'])
+            self.assertEqual(vals['capture_method'], 'automatic')
+            self.assertEqual(vals['return_url'], 'https://IwillBeBack.vd')
+            self.assertTrue(vals['confirm'])
+            self.assertEqual(transaction.state, 'succeeded')
+            self.assertEqual(transaction.external_id, intent['id'])
+            self.assertEqual(transaction.risk_level, 'normal')
+            self.assertFalse(payment_intent.capture.called)
+
+            payment_intent.retrieve.return_value = dict(
+                intent, status='requires_action')
+            with transaction._get_provider() as provider:
+                self.assertEqual(provider.get_state(), 'pending')
+            payment_intent.retrieve.assert_called_once_with(
+                intent['id'], api_key=self.stripe_api)